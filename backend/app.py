@@ -2,13 +2,45 @@ import os
 import shutil
 import datetime
 import functools
+import re
+from contextlib import contextmanager, closing
+from collections import defaultdict, OrderedDict
+import hashlib
+import math
+import sqlite3
+import mimetypes
+import tempfile
+import threading
+import importlib.util
+import multiprocessing
+import queue
+import time
+import json
+import secrets
+import weakref
+import itertools
 from itsdangerous import URLSafeTimedSerializer
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Blueprint, current_app, request, jsonify, send_from_directory, send_file, stream_with_context
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import text, inspect
+from sqlalchemy.orm import DeclarativeBase, Session, joinedload, object_session
+from sqlalchemy import text, func, case, select, literal, event, inspect, or_, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError, IntegrityError
+from sqlalchemy.schema import CreateTable
 import logging
+import click
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+
+# Optional: PDF previews are disabled without PyMuPDF (imported lazily, in the render worker)
+HAS_PYMUPDF = importlib.util.find_spec('pymupdf') is not None
+# Optional: without NumPy the dashboard aggregates are computed in SQL
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+if HAS_NUMPY:
+    import numpy as np
+# Optional: Parquet / Arrow exports are disabled without PyArrow (imported lazily, in the export)
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,23 +50,58 @@ class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
-
-app = Flask(__name__, static_folder='../dist', static_url_path='/')
-CORS(app)  # Enable CORS for development
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(os.getcwd(), 'data', 'chantier.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'data', 'uploads')
-try:
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-except OSError as e:
-    logger.warning(f"Could not create upload folder {app.config['UPLOAD_FOLDER']}: {e}")
-
-
-# Security Config
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'ohm-flow-secure-key-change-me-in-prod')
-serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-
-db.init_app(app)
+api = Blueprint('api', __name__)
+
+def parse_hourly_rates(value):
+    """'user=60,depanneur=75' -> {'user': 60.0, 'depanneur': 75.0}"""
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            role, rate = item.split('=', 1)
+            rates[role.strip()] = float(rate)
+    return rates
+
+def default_config():
+    """Configuration used by create_app(); nothing here touches the disk."""
+    return {
+        'DATA_FOLDER': os.path.join(os.getcwd(), 'data'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        # Security Config
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'ohm-flow-secure-key-change-me-in-prod'),
+        # File download offload: '' (Flask streams the file), 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd)
+        'FILE_OFFLOAD': os.environ.get('FILE_OFFLOAD', '').lower(),
+        'X_ACCEL_PREFIX': os.environ.get('X_ACCEL_PREFIX', '/protected-uploads/'),
+        'PREVIEW_WORKERS': int(os.environ.get('PREVIEW_WORKERS', 1)),
+        'SQLITE_BUSY_TIMEOUT_MS': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000)),
+        # Group commit: new entries from concurrent requests are inserted together in one transaction
+        'GROUP_COMMIT': os.environ.get('GROUP_COMMIT', '0') == '1',
+        'GROUP_COMMIT_WINDOW_MS': int(os.environ.get('GROUP_COMMIT_WINDOW_MS', 5)),
+        'GROUP_COMMIT_MAX_BATCH': int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 256)),
+        # Labor cost per hour by worker role, for /api/reports/chantiers ('user' also applies to unknown roles)
+        'HOURLY_RATES': parse_hourly_rates(os.environ.get('HOURLY_RATES', 'user=60,depanneur=60,admin=60')),
+        # Weekly hours above which /api/reports/payroll counts overtime
+        'PAYROLL_WEEKLY_HOURS': float(os.environ.get('PAYROLL_WEEKLY_HOURS', 40)),
+        # Concurrent /api/events streams per process; each one holds a worker thread (gthread)
+        'EVENTS_MAX_STREAMS': int(os.environ.get('EVENTS_MAX_STREAMS', 4)),
+        # Stats / report responses kept in memory per process (LRU)
+        'RESULT_CACHE_SIZE': int(os.environ.get('RESULT_CACHE_SIZE', 64)),
+        # Background exports (POST /api/exports): worker threads, and how long finished files are kept
+        'EXPORT_WORKERS': int(os.environ.get('EXPORT_WORKERS', 1)),
+        'EXPORT_RETENTION_HOURS': float(os.environ.get('EXPORT_RETENTION_HOURS', 24)),
+        # Open a connection and check the schema when the app is created, instead of on the first request
+        'PREWARM': False,
+        # How long a stored Idempotency-Key response is replayed
+        'IDEMPOTENCY_TTL_HOURS': int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24)),
+        # Seconds after which gunicorn kills a request (same variable as gunicorn.conf.py)
+        'REQUEST_TIMEOUT': int(os.environ.get('GUNICORN_TIMEOUT', 120)),
+    }
+
+def get_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+
+def user_from_token(token):
+    data = get_serializer().loads(token, max_age=86400) # Valid for 24h
+    return User.query.get(data['user_id'])
 
 def token_required(f):
     @functools.wraps(f)
@@ -46,8 +113,7 @@ def token_required(f):
         try:
             # Format: Bearer <token>
             token = auth_header.split(" ")[1]
-            data = serializer.loads(token, max_age=86400) # Valid for 24h
-            current_user = User.query.get(data['user_id'])
+            current_user = user_from_token(token)
             if not current_user:
                 raise Exception('User not found')
         except Exception as e:
@@ -56,14 +122,6 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
-# Enable WAL mode for SQLite (Better concurrency)
-with app.app_context():
-    try:
-        db.engine.connect().execute(text("PRAGMA journal_mode=WAL;"))
-        logger.info("SQLite WAL mode enabled.")
-    except Exception as e:
-        logger.warning(f"Could not enable WAL mode: {e}")
-
 # --- Models ---
 
 # --- Models ---
@@ -71,7 +129,9 @@ with app.app_context():
 # Association table for User <-> Chantier
 chantier_members = db.Table('chantier_members',
     db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
-    db.Column('chantier_id', db.Integer, db.ForeignKey('chantiers.id'), primary_key=True)
+    db.Column('chantier_id', db.Integer, db.ForeignKey('chantiers.id'), primary_key=True),
+    # PK is (user_id, chantier_id): lookups by chantier need their own index
+    db.Index('ix_chantier_members_chantier_id', 'chantier_id')
 )
 
 class User(db.Model):
@@ -94,8 +154,10 @@ class Chantier(db.Model):
     __tablename__ = 'chantiers'
     id = db.Column(db.Integer, primary_key=True)
     nom = db.Column(db.String(100), nullable=False)
-    annee = db.Column(db.Integer, nullable=False)
+    annee = db.Column(db.Integer, nullable=False, index=True)
     plan_pdf_path = db.Column(db.String(255), nullable=True)
+    plan_pdf_sha256 = db.Column(db.String(64), nullable=True) # Content hash, used for the ETag
+    plan_pdf_size = db.Column(db.Integer, nullable=True)
     pdf_path = db.Column(db.String(200), nullable=True)
     
     # New fields
@@ -104,13 +166,18 @@ class Chantier(db.Model):
     date_start = db.Column(db.String(20), nullable=True)
     date_end = db.Column(db.String(20), nullable=True)
     remarque = db.Column(db.Text, nullable=True)
-    status = db.Column(db.String(20), default='FUTURE') # FUTURE, ACTIVE, DONE
+    status = db.Column(db.String(20), default='FUTURE', index=True) # FUTURE, ACTIVE, DONE
+    budget = db.Column(db.Float, nullable=True) # Optional, compared to costs in /api/reports/chantiers
     
     # Relationships
-    members = db.relationship('User', secondary=chantier_members, lazy='subquery',
+    # Full User rows are only loaded when .members is accessed;
+    # to_dict reads member ids straight from chantier_members instead.
+    members = db.relationship('User', secondary=chantier_members, lazy='select',
         backref=db.backref('chantiers', lazy=True))
 
-    def to_dict(self):
+    def to_dict(self, member_ids=None):
+        if member_ids is None:
+            member_ids = member_ids_by_chantier([self.id])[self.id]
         return {
             'id': self.id,
             'nom': self.nom,
@@ -123,20 +190,56 @@ class Chantier(db.Model):
             'date_end': self.date_end,
             'remarque': self.remarque,
             'status': self.status,
-            'members': [u.id for u in self.members]
+            'budget': self.budget,
+            'members': member_ids
         }
 
+def member_ids_by_chantier(chantier_ids):
+    """Map chantier id -> member user ids, in one query on the association table.
+
+    chantier_ids can be a list or a select of ids (e.g. a list query's id column).
+    """
+    rows = db.session.query(chantier_members.c.chantier_id, chantier_members.c.user_id).filter(
+        chantier_members.c.chantier_id.in_(chantier_ids)
+    ).order_by(chantier_members.c.chantier_id, chantier_members.c.user_id).all()
+    result = defaultdict(list)
+    for chantier_id, user_id in rows:
+        result[chantier_id].append(user_id)
+    return result
+
+# Running sums of entries per (chantier, worker, validated), kept up to date by the
+# ENTRY_TOTALS_SQL triggers: per-chantier totals read this instead of the entries table.
+entry_totals = db.Table('entry_totals',
+    db.Column('chantier_id', db.Integer, primary_key=True),
+    db.Column('user_id', db.Integer, primary_key=True),
+    db.Column('validated', db.Boolean, primary_key=True),
+    db.Column('hours', db.Float, nullable=False, default=0.0),
+    db.Column('material', db.Float, nullable=False, default=0.0),
+    db.Column('entries', db.Integer, nullable=False, default=0),
+    sqlite_with_rowid=False
+)
+
+ENTRY_STATUSES = ['PENDING', 'VALIDATED']
+
 class Entry(db.Model):
     __tablename__ = 'entries'
+    __table_args__ = (
+        # Timesheet ranges: WHERE user_id = ? AND date BETWEEN ? AND ? (also serves user_id alone)
+        db.Index('ix_entries_user_id_date', 'user_id', 'date'),
+        # Company-wide date ranges (payroll report)
+        db.Index('ix_entries_date', 'date'),
+        # Ids of archived rows are never handed out again (they would collide in the archive file)
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    chantier_id = db.Column(db.Integer, db.ForeignKey('chantiers.id'), nullable=False)
+    chantier_id = db.Column(db.Integer, db.ForeignKey('chantiers.id'), nullable=False, index=True)
     date = db.Column(db.String(20), nullable=False)
     heures = db.Column(db.Float, nullable=False, default=0.0)
     materiel = db.Column(db.Float, nullable=False, default=0.0)
     
     # New fields
-    status = db.Column(db.String(20), default='PENDING') # PENDING, VALIDATED
+    status = db.Column(db.String(20), default='PENDING', index=True) # PENDING, VALIDATED
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     
     user = db.relationship('User', foreign_keys=[user_id], backref='entries')
@@ -160,7 +263,7 @@ class Entry(db.Model):
 class Leave(db.Model):
     __tablename__ = 'leaves'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     type = db.Column(db.String(20), nullable=False) # VACATION, SICKNESS
     date_start = db.Column(db.String(20), nullable=False)
     date_end = db.Column(db.String(20), nullable=False)
@@ -183,8 +286,9 @@ class Leave(db.Model):
 
 class Alert(db.Model):
     __tablename__ = 'alerts'
+    __table_args__ = {'sqlite_autoincrement': True} # Archived ids are never reused
     id = db.Column(db.Integer, primary_key=True)
-    chantier_id = db.Column(db.Integer, db.ForeignKey('chantiers.id'), nullable=False)
+    chantier_id = db.Column(db.Integer, db.ForeignKey('chantiers.id'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     due_date = db.Column(db.String(20), nullable=True)
@@ -203,79 +307,825 @@ class Alert(db.Model):
             'is_resolved': self.is_resolved
         }
 
+class ArchivedChantier(db.Model):
+    # Small index kept in the hot database: which yearly archive file holds a chantier
+    __tablename__ = 'archived_chantiers'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False) # Original chantier id
+    year = db.Column(db.Integer, nullable=False, index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class IdempotencyKey(db.Model):
+    # Response of a create request sent with an Idempotency-Key header, replayed on retry
+    __tablename__ = 'idempotency_keys'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    endpoint = db.Column(db.String(255), nullable=False) # Method and path, e.g. POST /api/leaves
+    status_code = db.Column(db.Integer, nullable=True) # NULL while the first attempt is running
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True) # TTL pruning
+
+class StreamTicket(db.Model):
+    # Single-use credential for /api/events: EventSource URLs end up in access logs, tokens must not
+    __tablename__ = 'stream_tickets'
+    ticket = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class Change(db.Model):
+    # Append-only log of row changes, read by /api/sync. Filled by the mapper events below.
+    __tablename__ = 'changes'
+    __table_args__ = {'sqlite_autoincrement': True} # Sequence numbers are never reused
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(30), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False) # INSERT, UPDATE, DELETE
+
+class Document(db.Model):
+    __tablename__ = 'documents'
+    __table_args__ = {'sqlite_autoincrement': True} # Archived ids are never reused
+    id = db.Column(db.Integer, primary_key=True)
+    chantier_id = db.Column(db.Integer, db.ForeignKey('chantiers.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False, default='OTHER') # PLAN, DEVIS, PHOTO, OTHER
+    filename = db.Column(db.String(255), nullable=False) # Original name, for display only
+    size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True) # Blob key, shared by identical files
+    mime = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    @property
+    def blob_path(self):
+        return blob_path(self.sha256)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'chantier_id': self.chantier_id,
+            'kind': self.kind,
+            'filename': self.filename,
+            'size': self.size,
+            'sha256': self.sha256,
+            'mime': self.mime,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+# --- Change Log ---
+# Every ORM insert/update/delete of a synced model appends to `changes` in the same
+# transaction. Writes that bypass the ORM (member table, archiving) call record_change().
+SYNC_MODELS = {model.__tablename__: model for model in (User, Chantier, Entry, Leave, Alert)}
+
+def record_change(connection, table_name, row_id, op):
+    connection.execute(Change.__table__.insert().values(table_name=table_name, row_id=row_id, op=op))
+
+def change_listener(op):
+    def listener(mapper, connection, target):
+        # after_update also fires for objects flushed without any net change
+        if op == 'UPDATE' and not object_session(target).is_modified(target):
+            return
+        record_change(connection, mapper.local_table.name, target.id, op)
+    return listener
+
+for model in SYNC_MODELS.values():
+    event.listen(model, 'after_insert', change_listener('INSERT'))
+    event.listen(model, 'after_update', change_listener('UPDATE'))
+    event.listen(model, 'after_delete', change_listener('DELETE'))
+
+# --- Notifications ---
+# Entry and leave creations / status changes, pushed to admins through /api/events.
+# Collected per session during the flush and only published once the session commits.
+NOTIFIED_MODELS = {Entry: 'entry', Leave: 'leave'}
+
+class EventBroker:
+    """In-process pub/sub: one queue per connected /api/events stream."""
+
+    def __init__(self, max_queued=100):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.max_queued = max_queued
+
+    def subscribe(self, max_subscribers):
+        """A new queue, or None when max_subscribers streams are already open."""
+        with self.lock:
+            if len(self.subscribers) >= max_subscribers:
+                return None
+            subscription = queue.Queue()
+            self.subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, name, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            if subscription.qsize() >= self.max_queued:
+                # Client not reading: end its stream, EventSource reconnects and refetches
+                self.unsubscribe(subscription)
+                subscription.put(None)
+            else:
+                subscription.put((name, data))
+
+event_broker = EventBroker()
+
+def notification_listener(action):
+    def listener(mapper, connection, target):
+        if action == 'status' and not inspect(target).attrs.status.history.has_changes():
+            return
+        data = {'id': target.id, 'user_id': target.user_id, 'status': target.status}
+        if isinstance(target, Entry):
+            data['chantier_id'] = target.chantier_id
+        name = f"{NOTIFIED_MODELS[type(target)]}_{action}"
+        object_session(target).info.setdefault('notifications', []).append((name, data))
+    return listener
+
+for model in NOTIFIED_MODELS:
+    event.listen(model, 'after_insert', notification_listener('created'))
+    event.listen(model, 'after_update', notification_listener('status'))
+    event.listen(model, 'after_delete', notification_listener('deleted'))
+
+@event.listens_for(Session, 'after_commit')
+def publish_notifications(session):
+    for name, data in session.info.pop('notifications', []):
+        event_broker.publish(name, data)
+
+@event.listens_for(Session, 'after_rollback')
+def drop_notifications(session):
+    session.info.pop('notifications', None)
+
+# --- Analytics ---
+# Entries held as NumPy columns so dashboard aggregates never scan SQLite. Loaded once
+# (prewarm or first use), then caught up from the change log before every read: rows
+# changed since, by this process or any other (CLI scripts, extra gunicorn workers), are
+# read again by id. Writes that bypass the change log call invalidate().
+ENTRY_STATUS_CODES = {'PENDING': 0, 'VALIDATED': 1}
+OTHER_STATUS = 2 # NULL or unknown status
+ENTRY_STATUS_NAMES = {**{code: name for name, code in ENTRY_STATUS_CODES.items()}, OTHER_STATUS: 'OTHER'}
+
+def parse_day(value):
+    """YYYY-MM-DD as numpy.datetime64 (NaT when the date can't be parsed)."""
+    try:
+        return np.datetime64(str(value)[:10], 'D')
+    except ValueError:
+        return np.datetime64('NaT', 'D')
+
+class EntryColumns:
+    """The entries table as column arrays, in id order.
+
+    Deleted rows are only flagged (`live`) and compacted away once they are half of
+    the arrays; the arrays grow by doubling, so catching up is O(changes). `seq` is the
+    last change log seq the arrays reflect.
+    """
+
+    CATCH_UP_MAX = 50000 # More changed entries than this: reload instead
+
+    DTYPES = {'id': 'int64', 'day': 'datetime64[D]', 'month': 'datetime64[M]', 'user_id': 'int64',
+              'chantier_id': 'int64', 'hours': 'float64', 'material': 'float64', 'status': 'int8', 'live': 'bool'}
+    GROUP_KEYS = ('day', 'month', 'year', 'user_id', 'chantier_id', 'status')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.RLock()
+        self.stale = True
+        self.seq = 0
+        self.size = 0
+        self.dead = 0
+        self.arrays = {name: np.empty(0, dtype) for name, dtype in self.DTYPES.items()}
+
+    def refresh(self):
+        """Bring the columns up to date: load them, or re-read the entries changed since `seq`."""
+        with self.lock:
+            if self.stale:
+                self.load()
+                return
+            with self.engine.connect() as conn:
+                seq = conn.exec_driver_sql("SELECT COALESCE(MAX(seq), 0) FROM changes").scalar()
+                if seq <= self.seq:
+                    return
+                changed = conn.exec_driver_sql(
+                    "SELECT DISTINCT row_id FROM changes WHERE table_name = 'entries' AND seq > ? AND seq <= ?",
+                    (self.seq, seq)).scalars().all()
+                if len(changed) > self.CATCH_UP_MAX:
+                    rows = None
+                else:
+                    # Rows are read after `seq`: at least as new as it, a later change is read again next time
+                    rows = {}
+                    for start in range(0, len(changed), 500):
+                        chunk = changed[start:start + 500]
+                        rows.update((row[0], row[1:]) for row in conn.exec_driver_sql(
+                            f"SELECT id, date, user_id, chantier_id, heures, materiel, status FROM entries "
+                            f"WHERE id IN ({', '.join('?' * len(chunk))})", tuple(chunk)))
+            if rows is None:
+                self.load()
+                return
+            for entry_id in changed:
+                self._put(entry_id, rows.get(entry_id)) # Absent: deleted or archived
+            if self.dead > self.size // 2:
+                self._compact()
+            self.seq = seq
+
+    def invalidate(self):
+        """Reload everything from the database on next use."""
+        with self.lock:
+            self.stale = True
+
+    def load(self):
+        status_sql = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in ENTRY_STATUS_CODES.items())
+        # Days since 1970-01-01 (NULL when the date is malformed)
+        sql = (f"SELECT id, julianday(substr(date, 1, 10)) - 2440587.5, user_id, chantier_id, heures, materiel, "
+               f"CASE status {status_sql} ELSE {OTHER_STATUS} END FROM entries ORDER BY id")
+        start = time.perf_counter()
+        with self.lock:
+            chunks = []
+            with self.engine.connect() as conn:
+                # Read first: changes committed during the load are re-read by the next refresh()
+                seq = conn.exec_driver_sql("SELECT COALESCE(MAX(seq), 0) FROM changes").scalar()
+                cursor = conn.connection.cursor()
+                cursor.execute(sql)
+                while rows := cursor.fetchmany(65536):
+                    chunks.append(np.array(rows, dtype='float64'))
+                cursor.close()
+            table = np.concatenate(chunks) if chunks else np.empty((0, 7))
+            days = table[:, 1]
+            known = ~np.isnan(days)
+            day = np.full(len(table), np.datetime64('NaT'), 'datetime64[D]')
+            day[known] = days[known].astype('int64').astype('datetime64[D]')
+            self.arrays = {
+                'id': table[:, 0].astype('int64'),
+                'day': day,
+                'month': day.astype('datetime64[M]'),
+                'user_id': table[:, 2].astype('int64'),
+                'chantier_id': table[:, 3].astype('int64'),
+                'hours': table[:, 4].copy(),
+                'material': table[:, 5].copy(),
+                'status': table[:, 6].astype('int8'),
+                'live': np.ones(len(table), 'bool'),
+            }
+            self.size = len(table)
+            self.dead = 0
+            self.seq = seq
+            self.stale = False
+        logger.info(f"Entry analytics: {self.size} entries loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def _put(self, entry_id, values):
+        """Set one entry's (date, user_id, chantier_id, hours, material, status), None if it is gone."""
+        ids = self.arrays['id'][:self.size]
+        index = int(np.searchsorted(ids, entry_id))
+        if index == self.size or ids[index] != entry_id:
+            if values is None:
+                return
+            index = self._insert(index, entry_id)
+        live = self.arrays['live']
+        if values is None:
+            if live[index]:
+                live[index] = False
+                self.dead += 1
+            return
+        if not live[index]:
+            live[index] = True
+            self.dead -= 1
+        date, user_id, chantier_id, hours, material, status = values
+        day = parse_day(date)
+        self.arrays['day'][index] = day
+        self.arrays['month'][index] = day.astype('datetime64[M]')
+        self.arrays['user_id'][index] = user_id
+        self.arrays['chantier_id'][index] = chantier_id
+        self.arrays['hours'][index] = hours or 0.0
+        self.arrays['material'][index] = material or 0.0
+        self.arrays['status'][index] = ENTRY_STATUS_CODES.get(status, OTHER_STATUS)
+
+    def _insert(self, index, entry_id):
+        """New (not yet live) slot at index. Usually the end: concurrent commits can reach the
+        change log slightly out of id order, then only the few slots after it are shifted."""
+        if self.size == len(self.arrays['id']):
+            capacity = max(1024, 2 * self.size)
+            for name, array in self.arrays.items():
+                grown = np.zeros(capacity, array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = grown
+        for array in self.arrays.values():
+            array[index + 1:self.size + 1] = array[index:self.size]
+        self.arrays['id'][index] = entry_id
+        self.arrays['live'][index] = False
+        self.size += 1
+        self.dead += 1
+        return index
+
+    def _compact(self):
+        keep = self.arrays['live'][:self.size]
+        self.arrays = {name: array[:self.size][keep] for name, array in self.arrays.items()}
+        self.size = len(self.arrays['id'])
+        self.dead = 0
+
+    def _selected(self, user_id=None, chantier_id=None, status=None, date_from=None, date_to=None):
+        """Columns trimmed to size, and the mask of the live rows matching the filters (dates inclusive)."""
+        self.refresh()
+        columns = {name: array[:self.size] for name, array in self.arrays.items()}
+        selected = columns['live'].copy()
+        if user_id is not None:
+            selected &= columns['user_id'] == user_id
+        if chantier_id is not None:
+            selected &= columns['chantier_id'] == chantier_id
+        if status is not None:
+            selected &= columns['status'] == ENTRY_STATUS_CODES.get(status, OTHER_STATUS)
+        if date_from:
+            selected &= columns['day'] >= np.datetime64(date_from, 'D')
+        if date_to:
+            selected &= columns['day'] <= np.datetime64(date_to, 'D')
+        return columns, selected
+
+    def totals(self, **filters):
+        """{'entries', 'hours', 'material'} over the entries matching the filters."""
+        with self.lock:
+            columns, selected = self._selected(**filters)
+            return {
+                'entries': int(np.count_nonzero(selected)),
+                'hours': float(columns['hours'].sum(where=selected)),
+                'material': float(columns['material'].sum(where=selected)),
+            }
+
+    def group_by(self, key, **filters):
+        """Totals per value of `key` (one of GROUP_KEYS): {value: {'entries', 'hours', 'material'}}.
+
+        Days, months and years come back as 'YYYY-MM-DD', 'YYYY-MM' and int, statuses by name;
+        entries with a malformed date are left out of the date groupings.
+        """
+        if key not in self.GROUP_KEYS:
+            raise ValueError(f"Unknown group key: {key}")
+        with self.lock:
+            columns, selected = self._selected(**filters)
+            hours = columns['hours']
+            material = columns['material']
+            if key in ('day', 'month', 'year'):
+                dates = columns['day' if key == 'day' else 'month']
+                selected &= ~np.isnat(dates)
+                keys = dates.view('int64')
+            else:
+                keys = columns[key]
+            if not selected.all(): # Unfiltered dashboards skip the copies
+                keys, hours, material = keys[selected], hours[selected], material[selected]
+            if key == 'year':
+                keys = keys // 12 # Months since 1970
+            if not len(keys):
+                return {}
+            # Still under the lock: unfiltered, these are views of the live columns, which
+            # after_commit hooks patch in place
+            # Dense keys (ids, dates): bincount over the key range; sparse ones go through unique()
+            if keys.max() - keys.min() < 4 * len(keys) + 1024:
+                offset = keys.min()
+                groups = keys - offset
+                values = np.arange(groups.max() + 1) + offset
+            else:
+                values, groups = np.unique(keys, return_inverse=True)
+            counts = np.bincount(groups)
+            hours = np.bincount(groups, weights=hours)
+            material = np.bincount(groups, weights=material)
+        result = {}
+        for group in np.flatnonzero(counts):
+            value = int(values[group])
+            if key == 'day':
+                value = str(np.datetime64(value, 'D'))
+            elif key == 'month':
+                value = str(np.datetime64(value, 'M'))
+            elif key == 'year':
+                value = 1970 + value
+            elif key == 'status':
+                value = ENTRY_STATUS_NAMES.get(value, 'OTHER')
+            result[value] = {'entries': int(counts[group]), 'hours': float(hours[group]),
+                             'material': float(material[group])}
+        return result
+
+_entry_columns = weakref.WeakKeyDictionary() # Engine -> EntryColumns
+_entry_columns_lock = threading.Lock()
+
+def get_entry_columns(engine=None):
+    """The EntryColumns of the app's database (loaded on first use), None without NumPy."""
+    if not HAS_NUMPY:
+        return None
+    engine = engine or db.engine
+    with _entry_columns_lock:
+        columns = _entry_columns.get(engine)
+        if columns is None:
+            columns = _entry_columns[engine] = EntryColumns(engine)
+    return columns
+
 # --- Database Initialization ---
 # --- Database Initialization ---
-def init_db():
-    data_dir = os.path.join(os.getcwd(), 'data')
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    
-    with app.app_context():
-        db.create_all()
-        
-        # --- Auto-Migration for existing databases ---
-        inspector = inspect(db.engine)
-        existing_tables = inspector.get_table_names()
 
-        with db.engine.connect() as conn:
-            # 1. Users Table
-            if 'users' in existing_tables:
-                cols = [c['name'] for c in inspector.get_columns('users')]
-                if 'vacation_balance' not in cols:
-                    logger.info("Migrating users: adding vacation_balance")
-                    conn.execute(text("ALTER TABLE users ADD COLUMN vacation_balance FLOAT DEFAULT 0.0"))
-                    conn.commit()
-
-            # 2. Chantiers Table
-            if 'chantiers' in existing_tables:
-                cols = [c['name'] for c in inspector.get_columns('chantiers')]
-                new_cols = {
-                    'address_work': 'VARCHAR(200)',
-                    'address_billing': 'VARCHAR(200)',
-                    'date_start': 'VARCHAR(20)',
-                    'date_end': 'VARCHAR(20)',
-                    'remarque': 'TEXT',
-                    'status': "VARCHAR(20) DEFAULT 'FUTURE'",
-                    'plan_pdf_path': "VARCHAR(255)"
-                }
-                for col_name, col_type in new_cols.items():
-                    if col_name not in cols:
-                        logger.info(f"Migrating chantiers: adding {col_name}")
-                        conn.execute(text(f"ALTER TABLE chantiers ADD COLUMN {col_name} {col_type}"))
-                        conn.commit()
-
-            # 3. Entries Table
-            if 'entries' in existing_tables:
-                cols = [c['name'] for c in inspector.get_columns('entries')]
-                if 'status' not in cols:
-                    logger.info("Migrating entries: adding status")
-                    conn.execute(text("ALTER TABLE entries ADD COLUMN status VARCHAR(20) DEFAULT 'PENDING'"))
-                    conn.commit()
-                if 'created_by_id' not in cols:
-                    logger.info("Migrating entries: adding created_by_id")
-                    conn.execute(text("ALTER TABLE entries ADD COLUMN created_by_id INTEGER REFERENCES users(id)"))
-                    conn.commit()
-
-        # Create default admin if not exists
-        if not User.query.filter_by(username='Admin').first():
-            # Default Admin PIN: 000000
-            admin = User(username='Admin', pin='000000', role='admin')
-            db.session.add(admin)
+# FTS5 index over chantier text fields (external content: rows live in `chantiers`, kept in sync by triggers)
+CHANTIERS_FTS_SQL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chantiers_fts USING fts5(
+        nom, address_work, address_billing, remarque,
+        content='chantiers', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chantiers_fts_ai AFTER INSERT ON chantiers BEGIN
+        INSERT INTO chantiers_fts(rowid, nom, address_work, address_billing, remarque)
+        VALUES (new.id, new.nom, new.address_work, new.address_billing, new.remarque);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chantiers_fts_ad AFTER DELETE ON chantiers BEGIN
+        INSERT INTO chantiers_fts(chantiers_fts, rowid, nom, address_work, address_billing, remarque)
+        VALUES ('delete', old.id, old.nom, old.address_work, old.address_billing, old.remarque);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chantiers_fts_au AFTER UPDATE ON chantiers BEGIN
+        INSERT INTO chantiers_fts(chantiers_fts, rowid, nom, address_work, address_billing, remarque)
+        VALUES ('delete', old.id, old.nom, old.address_work, old.address_billing, old.remarque);
+        INSERT INTO chantiers_fts(rowid, nom, address_work, address_billing, remarque)
+        VALUES (new.id, new.nom, new.address_work, new.address_billing, new.remarque);
+    END""",
+]
+
+# entry_totals maintenance: add the new row, subtract the old one, drop groups that become empty.
+# validated is 0/1, never NULL (it is part of the primary key): a NULL status counts as not validated.
+ENTRY_TOTALS_ADD = """
+    INSERT INTO entry_totals (chantier_id, user_id, validated, hours, material, entries)
+    VALUES (new.chantier_id, new.user_id, COALESCE(new.status = 'VALIDATED', 0), COALESCE(new.heures, 0), COALESCE(new.materiel, 0), 1)
+    ON CONFLICT (chantier_id, user_id, validated) DO UPDATE SET
+        hours = hours + excluded.hours, material = material + excluded.material, entries = entries + 1;"""
+ENTRY_TOTALS_SUBTRACT = """
+    UPDATE entry_totals SET
+        hours = hours - COALESCE(old.heures, 0), material = material - COALESCE(old.materiel, 0), entries = entries - 1
+    WHERE chantier_id = old.chantier_id AND user_id = old.user_id AND validated = COALESCE(old.status = 'VALIDATED', 0);
+    DELETE FROM entry_totals
+    WHERE chantier_id = old.chantier_id AND user_id = old.user_id AND validated = COALESCE(old.status = 'VALIDATED', 0)
+        AND entries <= 0;"""
+ENTRY_TOTALS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS entry_totals_ai AFTER INSERT ON entries BEGIN{ENTRY_TOTALS_ADD}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS entry_totals_ad AFTER DELETE ON entries BEGIN{ENTRY_TOTALS_SUBTRACT}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS entry_totals_au
+    AFTER UPDATE OF chantier_id, user_id, status, heures, materiel ON entries BEGIN{ENTRY_TOTALS_SUBTRACT}{ENTRY_TOTALS_ADD}
+    END""",
+]
+
+# --- Schema Migrations ---
+# Ordered registry: each migration runs once, inside a transaction, from `flask migrate-db`.
+# The applied version is recorded in schema_version; startup only reads that number.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+def column_names(conn, table):
+    return [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+
+def add_missing_columns(conn, table, columns):
+    """ALTER TABLE ... ADD COLUMN for each missing column (create_all already adds them on new databases)."""
+    existing = column_names(conn, table)
+    for col_name, col_type in columns.items():
+        if col_name not in existing:
+            logger.info(f"Migrating {table}: adding {col_name}")
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}")
+
+@migration(1, 'Create tables, add columns missing from pre-migration databases')
+def migrate_base_schema(conn):
+    db.metadata.create_all(conn)
+    add_missing_columns(conn, 'users', {'vacation_balance': 'FLOAT DEFAULT 0.0'})
+    add_missing_columns(conn, 'chantiers', {
+        'address_work': 'VARCHAR(200)',
+        'address_billing': 'VARCHAR(200)',
+        'date_start': 'VARCHAR(20)',
+        'date_end': 'VARCHAR(20)',
+        'remarque': 'TEXT',
+        'status': "VARCHAR(20) DEFAULT 'FUTURE'",
+        'plan_pdf_path': "VARCHAR(255)",
+        'plan_pdf_sha256': "VARCHAR(64)",
+        'plan_pdf_size': "INTEGER"
+    })
+    add_missing_columns(conn, 'entries', {
+        'status': "VARCHAR(20) DEFAULT 'PENDING'",
+        'created_by_id': 'INTEGER REFERENCES users(id)'
+    })
+
+@migration(2, 'Indexes declared on the models')
+def migrate_indexes(conn):
+    # create_all skips indexes of tables that already existed
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+@migration(3, 'Full-text search index on chantiers')
+def migrate_chantiers_fts(conn):
+    for statement in CHANTIERS_FTS_SQL:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("INSERT INTO chantiers_fts(chantiers_fts) VALUES ('rebuild')")
+
+@migration(4, 'Default admin user')
+def migrate_default_admin(conn):
+    if not conn.exec_driver_sql("SELECT 1 FROM users WHERE username = 'Admin'").first():
+        # Default Admin PIN: 000000
+        conn.exec_driver_sql("INSERT INTO users (username, pin, role, vacation_balance) VALUES ('Admin', '000000', 'admin', 0)")
+        logger.info("Default Admin user created with PIN 000000.")
+
+@migration(5, 'Idempotency keys')
+def migrate_idempotency_keys(conn):
+    IdempotencyKey.__table__.create(conn, checkfirst=True)
+
+@migration(6, 'Change log for delta sync')
+def migrate_changes(conn):
+    Change.__table__.create(conn, checkfirst=True)
+    # Existing rows count as inserted, so since=0 returns everything
+    for table_name in SYNC_MODELS:
+        conn.exec_driver_sql(f"INSERT INTO changes (table_name, row_id, op) SELECT '{table_name}', id, 'INSERT' "
+                             f"FROM {table_name} ORDER BY id")
+
+@migration(7, 'Composite (user_id, date) index on entries')
+def migrate_entries_user_date_index(conn):
+    # Replaces the single-column index, which is a prefix of the new one
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_entries_user_id")
+    for index in Entry.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+@migration(8, 'Date index on entries')
+def migrate_entries_date_index(conn):
+    for index in Entry.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+@migration(9, 'Chantier budget')
+def migrate_chantier_budget(conn):
+    add_missing_columns(conn, 'chantiers', {'budget': 'FLOAT'})
+
+def rebuild_entry_totals(conn):
+    conn.exec_driver_sql("DELETE FROM entry_totals")
+    conn.exec_driver_sql(
+        "INSERT INTO entry_totals (chantier_id, user_id, validated, hours, material, entries) "
+        "SELECT chantier_id, user_id, COALESCE(status = 'VALIDATED', 0), SUM(COALESCE(heures, 0)), "
+        "SUM(COALESCE(materiel, 0)), COUNT(*) FROM entries GROUP BY 1, 2, 3")
+
+@migration(10, 'Per-chantier entry totals maintained by triggers')
+def migrate_entry_totals(conn):
+    entry_totals.create(conn, checkfirst=True)
+    for statement in ENTRY_TOTALS_SQL:
+        conn.exec_driver_sql(statement)
+    rebuild_entry_totals(conn)
+
+def archived_max_id(table):
+    """Highest id of `table` across the yearly archive files, 0 if none."""
+    folder = current_app.config['ARCHIVE_FOLDER']
+    highest = 0
+    for name in (os.listdir(folder) if os.path.isdir(folder) else []):
+        if not re.fullmatch(r'archive_\d+\.db', name):
+            continue
+        with closing(sqlite3.connect(os.path.join(folder, name))) as archive:
+            try:
+                highest = max(highest, archive.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0)
+            except sqlite3.OperationalError:
+                pass # Table not archived into this file yet
+    return highest
+
+def rebuild_with_autoincrement(conn, table):
+    """Recreate `table` from its model (AUTOINCREMENT), keeping rows, extra columns, indexes and triggers."""
+    model_table = db.metadata.tables[table]
+    # Indexes added by migrations and the entry_totals triggers go away with the old table
+    dependents = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)).scalars().all()
+    create_sql = str(CreateTable(model_table).compile(dialect=conn.dialect)).strip()
+    conn.exec_driver_sql(re.sub(r'^CREATE TABLE "?\w+"?', f'CREATE TABLE {table}_new', create_sql))
+    declared = set(column_names(conn, f'{table}_new'))
+    for name, col_type in table_columns(conn, 'main', table):
+        if name not in declared:
+            conn.exec_driver_sql(f"ALTER TABLE {table}_new ADD COLUMN {name} {col_type}")
+    cols = ', '.join(column_names(conn, table))
+    conn.exec_driver_sql(f"INSERT INTO {table}_new ({cols}) SELECT {cols} FROM {table}")
+    conn.exec_driver_sql(f"DROP TABLE {table}")
+    conn.exec_driver_sql(f"ALTER TABLE {table}_new RENAME TO {table}")
+    for statement in dependents:
+        conn.exec_driver_sql(statement)
+
+@migration(11, 'Never reuse ids of archived entries, alerts and documents')
+def migrate_archived_ids(conn):
+    # Without AUTOINCREMENT SQLite hands out max(id) + 1, i.e. the ids of rows just archived:
+    # those would collide with the archived rows when archiving into the same yearly file.
+    for table in ('entries', 'alerts', 'documents'):
+        create_sql = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).scalar()
+        if 'AUTOINCREMENT' not in create_sql.upper():
+            rebuild_with_autoincrement(conn, table)
+        # Ids archived before this migration may be above the current max(id)
+        highest = max(archived_max_id(table), conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar())
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, highest))
+
+@migration(12, 'Stream tickets for /api/events')
+def migrate_stream_tickets(conn):
+    StreamTicket.__table__.create(conn, checkfirst=True)
+
+def schema_version():
+    """Applied schema version, 0 for a database that was never migrated."""
+    try:
+        return db.session.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except OperationalError:
+        return 0
+    finally:
+        db.session.rollback()
+
+def upgrade_db():
+    """Apply pending migrations, each one in its own transaction. Returns the versions applied."""
+    os.makedirs(current_app.config['DATA_FOLDER'], exist_ok=True)
+    applied = []
+    current = schema_version()
+    with db.engine.connect() as conn:
+        driver_conn = conn.connection.driver_connection
+        # Let SQLite see BEGIN/COMMIT as written: pysqlite would otherwise autocommit DDL
+        isolation_level, driver_conn.isolation_level = driver_conn.isolation_level, None
+        try:
+            conn.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+            for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+                if version <= current:
+                    continue
+                logger.info(f"Applying migration {version}: {description}")
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                try:
+                    fn(conn)
+                    conn.exec_driver_sql("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                                         (version, description))
+                    conn.exec_driver_sql("COMMIT")
+                except Exception:
+                    conn.exec_driver_sql("ROLLBACK")
+                    raise
+                applied.append(version)
+        finally:
+            driver_conn.isolation_level = isolation_level
+    return applied
+
+SCHEMA_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Bring the database schema up to date."""
+    applied = upgrade_db()
+    if applied:
+        click.echo(f"Applied migrations {', '.join(map(str, applied))}; schema is at version {SCHEMA_VERSION}.")
+    else:
+        click.echo(f"Schema is up to date (version {SCHEMA_VERSION}).")
+
+def check_schema_version():
+    # Startup only reads the schema version, migrations run from `flask migrate-db`
+    version = schema_version()
+    if version < SCHEMA_VERSION:
+        logger.warning(f"Database schema is at version {version}, expected {SCHEMA_VERSION}: "
+                       f"run `flask --app backend.app migrate-db`")
+    return version
+
+# --- Idempotency Keys ---
+# Retried POSTs (flaky site connections) carry the same Idempotency-Key header: the
+# first response is stored and replayed instead of inserting the row a second time.
+IDEMPOTENCY_PRUNE_INTERVAL = 600 # Seconds between two TTL prunes in a process
+_idempotency_pruned_at = 0.0
+
+def prune_idempotency_keys(cutoff):
+    global _idempotency_pruned_at
+    if time.monotonic() - _idempotency_pruned_at < IDEMPOTENCY_PRUNE_INTERVAL:
+        return
+    _idempotency_pruned_at = time.monotonic()
+    db.session.execute(IdempotencyKey.__table__.delete().where(IdempotencyKey.created_at < cutoff))
+
+def release_idempotency_key(user_id, key):
+    """Forget a reserved key so the client can retry a request that failed."""
+    db.session.rollback()
+    db.session.execute(IdempotencyKey.__table__.delete().where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key))
+    db.session.commit()
+
+def idempotent(f):
+    """Honor the Idempotency-Key header on POST. Goes under @token_required: keys are per user.
+
+    The key is reserved before the view runs, so a retry arriving while the first
+    attempt is still running gets a 409 instead of creating a second row. Only 2xx
+    responses are stored; failed attempts release the key. A reservation older than
+    REQUEST_TIMEOUT belongs to a request that died without releasing it (worker killed)
+    and is taken over.
+    """
+    @functools.wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or not key:
+            return f(current_user, *args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+
+        user_id = current_user.id
+        endpoint = f"{request.method} {request.path}"
+        now = datetime.datetime.utcnow()
+        cutoff = now - datetime.timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS'])
+        lease_cutoff = now - datetime.timedelta(seconds=current_app.config['REQUEST_TIMEOUT'])
+        prune_idempotency_keys(cutoff)
+        keys = IdempotencyKey.__table__
+        for _ in range(3):
+            # An expired key may be reused, and so may an abandoned reservation
+            db.session.execute(keys.delete().where(
+                keys.c.user_id == user_id, keys.c.key == key,
+                or_(keys.c.created_at < cutoff,
+                    and_(keys.c.status_code.is_(None), keys.c.created_at < lease_cutoff))))
+            reserved = db.session.execute(sqlite_insert(keys).values(
+                user_id=user_id, key=key, endpoint=endpoint, created_at=now
+            ).on_conflict_do_nothing()).rowcount
             db.session.commit()
-            logger.info("Default Admin user created with PIN 000000.")
+            if reserved:
+                break
+
+            stored = db.session.get(IdempotencyKey, (user_id, key))
+            if stored is None:
+                continue # Released or pruned since the insert: reserve it again
+            if stored.endpoint != endpoint:
+                return jsonify({'error': 'Idempotency-Key already used for another request'}), 422
+            if stored.status_code is None:
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+            response = current_app.response_class(stored.response, status=stored.status_code,
+                                                  mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        else:
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+
+        try:
+            response = current_app.make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            release_idempotency_key(user_id, key)
+            raise
+        if not 200 <= response.status_code < 300:
+            release_idempotency_key(user_id, key)
+            return response
+        db.session.execute(keys.update().where(keys.c.user_id == user_id, keys.c.key == key).values(
+            status_code=response.status_code, response=response.get_data(as_text=True)))
+        db.session.commit()
+        return response
+    return decorated
+
+# --- Result Cache ---
+# Stats and report responses, memoized per (request, role, data version, day). The data
+# version is the last seq of the change log, which every write path appends to (mapper
+# events, record_change, archiving), in any process. The day key covers the "current
+# year" / "current month" defaults, which change without any write.
+class ResultCache:
+    """Bounded LRU of finished responses: key -> (body, mimetype)."""
+
+    def __init__(self, max_entries):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+def data_version():
+    """Counter of committed writes: the last change log seq."""
+    return db.session.execute(select(func.max(Change.seq))).scalar() or 0
+
+def cached_result(f):
+    """Serve repeated GETs from the app's ResultCache. Goes under @token_required.
+
+    Only complete 200 responses are stored (not streamed CSVs). The role is part of the
+    key since admin-only views answer 403 to the others.
+    """
+    @functools.wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        cache = current_app.extensions['result_cache']
+        # Version read before computing: the response reflects at least this version (the
+        # entry columns catch up to the change log first), never an older one
+        key = (request.full_path, current_user.role, data_version(), datetime.date.today())
+        hit = cache.get(key)
+        if hit is not None:
+            body, mimetype = hit
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.headers['X-Result-Cache'] = 'hit'
+            return response
+        response = current_app.make_response(f(current_user, *args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            cache.put(key, (response.get_data(), response.mimetype))
+        return response
+    return decorated
 
 # --- Routes ---
 
-@app.route('/')
+@api.route('/')
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return send_from_directory(current_app.static_folder, 'index.html')
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(e):
-    return send_from_directory(app.static_folder, 'index.html')
+    return send_from_directory(current_app.static_folder, 'index.html')
 
 # API Routes
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     pin = data.get('pin')
@@ -283,11 +1133,11 @@ def login():
     # Simple PIN auth
     user = User.query.filter_by(pin=pin).first()
     if user:
-        token = serializer.dumps({'user_id': user.id})
+        token = get_serializer().dumps({'user_id': user.id})
         return jsonify({**user.to_dict(), 'token': token})
     return jsonify({'error': 'Invalid PIN'}), 401
 
-@app.route('/api/users', methods=['GET', 'POST', 'DELETE'])
+@api.route('/api/users', methods=['GET', 'POST', 'DELETE'])
 @token_required
 def manage_users(current_user):
     # Only Admin can manage users
@@ -314,7 +1164,7 @@ def manage_users(current_user):
 
     return jsonify({'error': 'Method not allowed on this endpoint, use /api/users/<id>'}), 405
 
-@app.route('/api/users/<int:user_id>', methods=['PUT', 'DELETE'])
+@api.route('/api/users/<int:user_id>', methods=['PUT', 'DELETE'])
 @token_required
 def user_operations(current_user, user_id):
     if current_user.role != 'admin':
@@ -358,7 +1208,7 @@ def user_operations(current_user, user_id):
         return jsonify(user.to_dict())
 
 
-@app.route('/api/backup', methods=['POST'])
+@api.route('/api/backup', methods=['POST'])
 @token_required
 def trigger_backup(current_user):
     if current_user.role != 'admin':
@@ -372,7 +1222,7 @@ def trigger_backup(current_user):
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # Backup DB
-        db_path = os.path.join(os.getcwd(), 'data', 'chantier.db')
+        db_path = os.path.join(current_app.config['DATA_FOLDER'], 'chantier.db')
         if os.path.exists(db_path):
             shutil.copy2(db_path, os.path.join(backup_dir, f'chantier_{timestamp}.db'))
             
@@ -387,7 +1237,24 @@ def trigger_backup(current_user):
         logger.error(f"Backup failed: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/chantiers', methods=['GET', 'POST'])
+def entry_totals_subquery():
+    """Entry count, hours, material and pending count per chantier, as a joinable subquery.
+
+    Reads the trigger-maintained entry_totals table (a few rows per chantier), not the entries.
+    """
+    return db.session.query(
+        entry_totals.c.chantier_id.label('chantier_id'),
+        func.sum(entry_totals.c.entries).label('entries'),
+        func.sum(entry_totals.c.hours).label('hours'),
+        func.sum(entry_totals.c.material).label('material'),
+        func.sum(case((entry_totals.c.validated, 0), else_=entry_totals.c.entries)).label('pending')
+    ).group_by(entry_totals.c.chantier_id).subquery()
+
+def valid_budget(value):
+    """A budget is a finite number or null (bool is an int subclass, not a budget)."""
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value))
+
+@api.route('/api/chantiers', methods=['GET', 'POST'])
 @token_required
 def manage_chantiers(current_user):
     if request.method == 'GET':
@@ -400,12 +1267,38 @@ def manage_chantiers(current_user):
             query = query.filter(Chantier.status == status)
         
         # Everyone sees all chantiers now (Requirement change)
-        
-        chantiers = query.all()
-        return jsonify([c.to_dict() for c in chantiers])
+
+        # Member ids for the whole list in one query, no User rows loaded
+        members = member_ids_by_chantier(query.with_entities(Chantier.id))
+
+        # ?include=totals adds per-chantier sums from one GROUP BY joined to the list
+        if 'totals' in request.args.get('include', '').split(','):
+            totals = entry_totals_subquery()
+            rows = query.outerjoin(totals, totals.c.chantier_id == Chantier.id).add_columns(
+                totals.c.entries, totals.c.hours, totals.c.material, totals.c.pending
+            ).all()
+            result = [{
+                **c.to_dict(member_ids=members[c.id]),
+                'totals': {
+                    'entries': entries or 0,
+                    'hours': round(hours or 0, 1),
+                    'material': round(material or 0, 2),
+                    'pending': pending or 0
+                }
+            } for c, entries, hours, material, pending in rows]
+        else:
+            chantiers = query.all()
+            result = [c.to_dict(member_ids=members[c.id]) for c in chantiers]
+        # ?archived=1 appends chantiers moved to the yearly archive files
+        if request.args.get('archived') == '1':
+            result += archived_chantier_dicts(status if status != 'ALL' else None,
+                                              totals='totals' in request.args.get('include', '').split(','))
+        return jsonify(result)
 
     if request.method == 'POST':
         data = request.json
+        if not valid_budget(data.get('budget')):
+            return jsonify({'error': 'budget must be a number or null'}), 400
         new_chantier = Chantier(
             nom=data['nom'],
             annee=data.get('annee', 2024),
@@ -415,16 +1308,55 @@ def manage_chantiers(current_user):
             date_start=data.get('date_start'),
             date_end=data.get('date_end'),
             remarque=data.get('remarque'),
-            status=data.get('status', 'FUTURE')
+            status=data.get('status', 'FUTURE'),
+            budget=data.get('budget')
         )
         
         # Members assignment removed
 
+        # SQLite hands out max(id) + 1: never reuse the id of an archived chantier
+        archived_max = db.session.query(func.max(ArchivedChantier.id)).scalar()
+        if archived_max and archived_max >= (db.session.query(func.max(Chantier.id)).scalar() or 0):
+            new_chantier.id = archived_max + 1
+
         db.session.add(new_chantier)
         db.session.commit()
         return jsonify(new_chantier.to_dict()), 201
 
-@app.route('/api/chantiers/<int:chantier_id>', methods=['PUT', 'GET'])
+@api.route('/api/chantiers/search', methods=['GET'])
+@token_required
+def search_chantiers(current_user):
+    # Prefix search over name, addresses and remarks, best matches first
+    words = request.args.get('q', '').split()
+    if not words:
+        return jsonify([])
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    # Each word is quoted (no FTS syntax from users) and prefix-matched: "vill"* "gen"*
+    match = ' '.join('"' + w.replace('"', '""') + '"*' for w in words)
+
+    sql = """
+        SELECT chantiers_fts.rowid FROM chantiers_fts
+        JOIN chantiers ON chantiers.id = chantiers_fts.rowid
+        WHERE chantiers_fts MATCH :match {status_filter}
+        ORDER BY bm25(chantiers_fts, 10.0, 4.0, 2.0, 1.0)
+        LIMIT :limit
+    """
+    params = {'match': match, 'limit': limit}
+    status = request.args.get('status')
+    if status and status != 'ALL':
+        sql = sql.format(status_filter='AND chantiers.status = :status')
+        params['status'] = status
+    else:
+        sql = sql.format(status_filter='')
+    ids = [row[0] for row in db.session.execute(text(sql), params)]
+    if not ids:
+        return jsonify([])
+
+    by_id = {c.id: c for c in Chantier.query.filter(Chantier.id.in_(ids))}
+    members = member_ids_by_chantier(ids)
+    return jsonify([by_id[i].to_dict(member_ids=members[i]) for i in ids])
+
+@api.route('/api/chantiers/<int:chantier_id>', methods=['PUT', 'GET'])
 @token_required
 def chantier_detail(current_user, chantier_id):
     chantier = db.session.get(Chantier, chantier_id)
@@ -436,6 +1368,8 @@ def chantier_detail(current_user, chantier_id):
 
     if request.method == 'PUT':
         data = request.json
+        if not valid_budget(data.get('budget')):
+            return jsonify({'error': 'budget must be a number or null'}), 400
         chantier.nom = data.get('nom', chantier.nom)
         chantier.annee = data.get('annee', chantier.annee)
         chantier.pdf_path = data.get('pdf_path', chantier.pdf_path)
@@ -445,10 +1379,195 @@ def chantier_detail(current_user, chantier_id):
         chantier.date_end = data.get('date_end', chantier.date_end)
         chantier.remarque = data.get('remarque', chantier.remarque)
         chantier.status = data.get('status', chantier.status)
+        chantier.budget = data.get('budget', chantier.budget)
         db.session.commit()
         return jsonify(chantier.to_dict())
 
-@app.route('/api/chantiers/<int:id>/pdf', methods=['POST'])
+@api.route('/api/chantiers/<int:chantier_id>/full', methods=['GET'])
+@token_required
+def chantier_full(current_user, chantier_id):
+    # Everything the detail page needs in one response, from 4 queries
+    # (chantier, members, entries joined to users, alerts) whatever the row counts.
+    chantier = db.session.get(Chantier, chantier_id)
+    if not chantier:
+        return jsonify({'error': 'Chantier not found'}), 404
+
+    members = db.session.query(User.id, User.username, User.role).join(
+        chantier_members, chantier_members.c.user_id == User.id
+    ).filter(chantier_members.c.chantier_id == chantier_id).order_by(User.username).all()
+
+    # ?user_id= (a worker's own view) also narrows the totals
+    entry_rows = filter_entries(db.session.query(Entry, User.username).join(
+        User, Entry.user_id == User.id
+    ).filter(Entry.chantier_id == chantier_id)).order_by(Entry.date.desc(), Entry.id.desc()).all()
+
+    # ?alerts=all also returns resolved alerts
+    alert_query = Alert.query.filter_by(chantier_id=chantier_id)
+    if request.args.get('alerts') != 'all':
+        alert_query = alert_query.filter_by(is_resolved=False)
+    alerts = alert_query.all()
+
+    entries = []
+    totals = {'entries': 0, 'hours': 0, 'material': 0, 'hours_validated': 0, 'hours_pending': 0, 'pending': 0}
+    for e, username in entry_rows:
+        entries.append({
+            'id': e.id,
+            'user_id': e.user_id,
+            'user_name': username,
+            'chantier_id': e.chantier_id,
+            'chantier_nom': chantier.nom,
+            'date': e.date,
+            'heures': e.heures,
+            'materiel': e.materiel,
+            'status': e.status,
+            'created_by_id': e.created_by_id
+        })
+        totals['entries'] += 1
+        totals['hours'] += e.heures
+        totals['material'] += e.materiel
+        if e.status == 'VALIDATED':
+            totals['hours_validated'] += e.heures
+        else:
+            totals['hours_pending'] += e.heures
+            totals['pending'] += 1
+
+    for key in ('hours', 'hours_validated', 'hours_pending'):
+        totals[key] = round(totals[key], 1)
+    totals['material'] = round(totals['material'], 2)
+
+    return jsonify({
+        'chantier': chantier.to_dict(member_ids=sorted(m.id for m in members)),
+        'members': [{'id': m.id, 'username': m.username, 'role': m.role} for m in members],
+        'entries': entries,
+        'alerts': [a.to_dict() for a in alerts],
+        'totals': totals
+    })
+
+def hash_file(path):
+    """Return (sha256 hexdigest, size) of a file, read in chunks."""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+def send_upload(filename, etag, mimetype):
+    """Send a file from UPLOAD_FOLDER once auth has passed.
+
+    With FILE_OFFLOAD=x-accel the body is left to the reverse proxy (nginx serves
+    ranges itself), so the worker is freed as soon as the headers are out.
+    With x-sendfile, Flask's USE_X_SENDFILE does the same through send_file.
+    """
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+    if current_app.config['FILE_OFFLOAD'] == 'x-accel':
+        response = current_app.response_class(mimetype=mimetype)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            return response
+        response.headers['X-Accel-Redirect'] = current_app.config['X_ACCEL_PREFIX'] + filename.replace(os.sep, '/')
+        return response
+
+    # conditional=True lets werkzeug answer If-None-Match (304), Range / If-Range (206)
+    response = send_file(path, mimetype=mimetype, as_attachment=False,
+                         conditional=True, etag=etag)
+    response.cache_control.private = True
+    return response
+
+# --- Document Storage ---
+# Files are stored once, by content: uploads/blobs/<sha[:2]>/<sha>.
+# Rows in `documents` point at blobs, so identical files are shared across chantiers
+# and a new version never overwrites an older blob.
+DOCUMENT_KINDS = ['PLAN', 'DEVIS', 'PHOTO', 'OTHER']
+
+def blob_path(sha256):
+    """Path of a blob, relative to UPLOAD_FOLDER."""
+    return os.path.join('blobs', sha256[:2], sha256)
+
+def store_blob(file):
+    """Stream an uploaded file into the blob store. Returns (sha256, size)."""
+    blob_root = os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs')
+    os.makedirs(blob_root, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=blob_root, suffix='.part')
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+                sha.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = sha.hexdigest()
+        target = os.path.join(current_app.config['UPLOAD_FOLDER'], blob_path(digest))
+        try:
+            # Already stored (same content): the new mtime keeps gc-blobs off it until our row is committed
+            os.utime(target)
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, size
+
+def save_document(chantier_id, file, kind):
+    """Store an uploaded file and add its Document row (caller commits)."""
+    sha256, size = store_blob(file)
+    mime = file.mimetype or mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+    document = Document(chantier_id=chantier_id, kind=kind, filename=file.filename,
+                        size=size, sha256=sha256, mime=mime)
+    db.session.add(document)
+    return document
+
+@api.route('/api/chantiers/<int:chantier_id>/documents', methods=['GET', 'POST'])
+@token_required
+def manage_documents(current_user, chantier_id):
+    if request.method == 'GET':
+        query = Document.query.filter_by(chantier_id=chantier_id)
+        kind = request.args.get('kind')
+        if kind:
+            query = query.filter_by(kind=kind)
+        documents = query.order_by(Document.created_at.desc()).all()
+        return jsonify([d.to_dict() for d in documents])
+
+    if request.method == 'POST':
+        if not db.session.query(Chantier.id).filter(Chantier.id == chantier_id).first():
+            return jsonify({'error': 'Chantier not found'}), 404
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'error': 'No file part'}), 400
+        kind = request.form.get('kind', 'OTHER')
+        if kind not in DOCUMENT_KINDS:
+            return jsonify({'error': 'Invalid kind'}), 400
+
+        document = save_document(chantier_id, request.files['file'], kind)
+        db.session.commit()
+        return jsonify(document.to_dict()), 201
+
+@api.route('/api/documents/<int:document_id>', methods=['GET', 'DELETE'])
+@token_required
+def document_operations(current_user, document_id):
+    document = db.session.get(Document, document_id)
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
+
+    if request.method == 'GET':
+        return send_upload(document.blob_path, etag=f"{document.sha256}-{document.size}", mimetype=document.mime)
+
+    if request.method == 'DELETE':
+        # The blob stays: it may be shared with other documents, archived ones included.
+        # `flask gc-blobs` removes the ones nothing references any more.
+        db.session.delete(document)
+        db.session.commit()
+        return jsonify({'message': 'Document deleted'})
+
+@api.route('/api/chantiers/<int:id>/pdf', methods=['POST'])
 @token_required
 def upload_chantier_pdf(current_user, id):
     chantier = Chantier.query.get_or_404(id)
@@ -459,24 +1578,146 @@ def upload_chantier_pdf(current_user, id):
         return jsonify({'error': 'No selected file'}), 400
     
     if file and file.filename.lower().endswith('.pdf'):
-        filename = f"chantier_{id}_plan.pdf"
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        chantier.plan_pdf_path = filename
+        # Each upload is a new PLAN document, the chantier points at the latest blob
+        document = save_document(id, file, 'PLAN')
+        chantier.plan_pdf_path = document.blob_path
+        chantier.plan_pdf_sha256, chantier.plan_pdf_size = document.sha256, document.size
         db.session.commit()
+        schedule_pdf_previews(chantier.plan_pdf_path, chantier.plan_pdf_sha256)
         return jsonify(chantier.to_dict())
     
     return jsonify({'error': 'Only PDF files are allowed'}), 400
 
-@app.route('/api/chantiers/<int:id>/pdf', methods=['GET'])
+def plan_pdf_info(chantier_id):
+    """Return (filename, sha256, size) of a chantier's plan, or an error response tuple."""
+    # Only the file columns are needed here, skip loading the full Chantier (and its members)
+    row = db.session.query(
+        Chantier.plan_pdf_path, Chantier.plan_pdf_sha256, Chantier.plan_pdf_size
+    ).filter(Chantier.id == chantier_id).first()
+    if not row:
+        return None, (jsonify({'error': 'Chantier not found'}), 404)
+    if not row.plan_pdf_path:
+        return None, (jsonify({'error': 'No PDF uploaded'}), 404)
+
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], row.plan_pdf_path)
+    if not os.path.exists(path):
+        return None, (jsonify({'error': 'PDF file missing'}), 404)
+
+    sha256, size = row.plan_pdf_sha256, row.plan_pdf_size
+    if not sha256 or size is None:
+        # PDF uploaded before hashes were stored: compute once and persist
+        sha256, size = hash_file(path)
+        db.session.query(Chantier).filter(Chantier.id == chantier_id).update(
+            {'plan_pdf_sha256': sha256, 'plan_pdf_size': size})
+        db.session.commit()
+    return (row.plan_pdf_path, sha256, size), None
+
+@api.route('/api/chantiers/<int:id>/pdf', methods=['GET'])
 @token_required
 def get_chantier_pdf(current_user, id):
-    chantier = Chantier.query.get_or_404(id)
-    if not chantier.plan_pdf_path:
-        return jsonify({'error': 'No PDF uploaded'}), 404
-    
-    return send_file(os.path.join(app.config['UPLOAD_FOLDER'], chantier.plan_pdf_path), as_attachment=False)
-
-@app.route('/api/chantiers/<int:chantier_id>/members', methods=['POST', 'DELETE'])
+    info, error = plan_pdf_info(id)
+    if error:
+        return error
+    filename, sha256, size = info
+    return send_upload(filename, etag=f"{sha256}-{size}", mimetype='application/pdf')
+
+# --- PDF Previews ---
+# Thumbnails and low-res pages are rendered in a process pool, keyed by content hash:
+# previews/<sha256>/thumb.png and previews/<sha256>/page_<n>.jpg
+PREVIEW_THUMB_WIDTH = 240
+PREVIEW_PAGE_WIDTH = 1000
+PREVIEW_MAX_PAGES = 30
+
+_preview_pool = None
+_preview_jobs = {}  # sha256 -> Future
+_preview_lock = threading.Lock()  # Request threads (gthread workers) share the pool and job map
+
+def render_pdf_previews(pdf_path, sha256, out_dir):
+    """Render previews of a PDF into out_dir. Runs in a worker process."""
+    import pymupdf
+    tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        # Legacy plans (chantier_<id>_plan.pdf) may have been replaced since the job was queued
+        if hash_file(pdf_path)[0] != sha256:
+            return 0
+        with pymupdf.open(pdf_path, filetype='pdf') as doc:
+            for i, page in enumerate(doc):
+                if i >= PREVIEW_MAX_PAGES:
+                    break
+                if i == 0:
+                    zoom = PREVIEW_THUMB_WIDTH / page.rect.width
+                    page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).save(os.path.join(tmp_dir, 'thumb.png'))
+                zoom = PREVIEW_PAGE_WIDTH / page.rect.width
+                page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).save(
+                    os.path.join(tmp_dir, f'page_{i + 1}.jpg'), jpg_quality=70)
+            pages = min(len(doc), PREVIEW_MAX_PAGES)
+        # Directory rename is atomic: out_dir existing means the previews are complete
+        os.rename(tmp_dir, out_dir)
+        return pages
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def get_preview_pool():
+    global _preview_pool
+    with _preview_lock:
+        if _preview_pool is None:
+            # spawn, not fork: a forked child would inherit the request threads' locks (held
+            # mid-request, never released in the child) and the SQLite connections
+            _preview_pool = ProcessPoolExecutor(max_workers=current_app.config['PREVIEW_WORKERS'],
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _preview_pool
+
+def schedule_pdf_previews(filename, sha256):
+    """Queue preview rendering for a stored PDF unless cached or already queued."""
+    if not HAS_PYMUPDF or not sha256:
+        return
+    out_dir = os.path.join(current_app.config['PREVIEW_FOLDER'], sha256)
+    if os.path.isdir(out_dir):
+        return
+    os.makedirs(current_app.config['PREVIEW_FOLDER'], exist_ok=True)
+    pool = get_preview_pool()
+
+    def on_done(future):
+        _preview_jobs.pop(sha256, None)
+        if future.exception():
+            logger.error(f"PDF preview rendering failed for {filename}: {future.exception()}")
+
+    pdf_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    with _preview_lock:
+        if sha256 in _preview_jobs:
+            return
+        future = pool.submit(render_pdf_previews, pdf_path, sha256, out_dir)
+        _preview_jobs[sha256] = future
+    future.add_done_callback(on_done)
+
+@api.route('/api/chantiers/<int:id>/pdf/preview', methods=['GET'])
+@token_required
+def get_chantier_pdf_preview(current_user, id):
+    # ?page=<n> for a low-res page, first-page thumbnail otherwise
+    page = request.args.get('page', type=int)
+    if not HAS_PYMUPDF:
+        return jsonify({'error': 'PDF previews are not available on this server'}), 501
+
+    info, error = plan_pdf_info(id)
+    if error:
+        return error
+    filename, sha256, size = info
+
+    preview_dir = os.path.join(current_app.config['PREVIEW_FOLDER'], sha256)
+    if not os.path.isdir(preview_dir):
+        schedule_pdf_previews(filename, sha256)
+        return jsonify({'status': 'pending'}), 202
+
+    name = f'page_{page}.jpg' if page else 'thumb.png'
+    if not os.path.exists(os.path.join(preview_dir, name)):
+        return jsonify({'error': 'Page preview not available'}), 404
+
+    mimetype = 'image/jpeg' if page else 'image/png'
+    return send_upload(os.path.join('previews', sha256, name), etag=f"{sha256}-{name}", mimetype=mimetype)
+
+@api.route('/api/chantiers/<int:chantier_id>/members', methods=['POST', 'DELETE', 'PUT'])
 @token_required
 def manage_chantier_members(current_user, chantier_id):
     chantier = db.session.get(Chantier, chantier_id)
@@ -484,33 +1725,323 @@ def manage_chantier_members(current_user, chantier_id):
         return jsonify({'error': 'Chantier not found'}), 404
         
     data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON object body required'}), 400
+
+    if request.method == 'PUT':
+        # Replace the whole team: {'user_ids': [...]}
+        user_ids = data.get('user_ids')
+        # bool is an int subclass: true/false are not ids
+        if not isinstance(user_ids, list) or not all(
+                isinstance(uid, int) and not isinstance(uid, bool) for uid in user_ids):
+            return jsonify({'error': 'user_ids must be a list of integer ids'}), 400
+        user_ids = set(user_ids)
+        known = {uid for (uid,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        if known != user_ids:
+            return jsonify({'error': 'User not found', 'user_ids': sorted(user_ids - known)}), 404
+
+        # Diff computed by SQLite: one DELETE for leavers, one INSERT ... SELECT for newcomers
+        db.session.execute(chantier_members.delete().where(
+            chantier_members.c.chantier_id == chantier_id,
+            chantier_members.c.user_id.not_in(user_ids)
+        ))
+        current = select(chantier_members.c.user_id).where(chantier_members.c.chantier_id == chantier_id)
+        db.session.execute(chantier_members.insert().from_select(
+            ['user_id', 'chantier_id'],
+            select(User.id, literal(chantier_id)).where(User.id.in_(user_ids), User.id.not_in(current))
+        ))
+        record_change(db.session, 'chantiers', chantier_id, 'UPDATE')
+        db.session.commit()
+        return jsonify(chantier.to_dict())
+
     user_id = data.get('user_id')
     user = db.session.get(User, user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
         
+    # Single member changes go straight to the association table (no collection load)
     if request.method == 'POST':
-        if user not in chantier.members:
-            chantier.members.append(user)
-            db.session.commit()
+        db.session.execute(sqlite_insert(chantier_members).values(
+            user_id=user.id, chantier_id=chantier_id
+        ).on_conflict_do_nothing())
+        record_change(db.session, 'chantiers', chantier_id, 'UPDATE')
+        db.session.commit()
         return jsonify(chantier.to_dict())
         
     if request.method == 'DELETE':
-        if user in chantier.members:
-            chantier.members.remove(user)
-            db.session.commit()
+        db.session.execute(chantier_members.delete().where(
+            chantier_members.c.chantier_id == chantier_id,
+            chantier_members.c.user_id == user.id
+        ))
+        record_change(db.session, 'chantiers', chantier_id, 'UPDATE')
+        db.session.commit()
         return jsonify(chantier.to_dict())
 
 
-@app.route('/api/chantiers/<int:chantier_id>/entries', methods=['GET'])
+# --- Delta Sync ---
+
+SYNC_LOADERS = {
+    'entries': [joinedload(Entry.user), joinedload(Entry.chantier)],
+    'leaves': [joinedload(Leave.user)],
+    'alerts': [joinedload(Alert.chantier)],
+}
+
+def sync_dicts(table_name, row_ids):
+    """Current state of the given rows, as the list endpoints return them. Missing ids are absent."""
+    model = SYNC_MODELS[table_name]
+    rows = model.query.options(*SYNC_LOADERS.get(table_name, [])).filter(model.id.in_(row_ids)).all()
+    if model is Chantier:
+        members = member_ids_by_chantier(row_ids)
+        return [c.to_dict(member_ids=members[c.id]) for c in rows]
+    return [r.to_dict() for r in rows]
+
+@api.route('/api/sync', methods=['GET'])
+@token_required
+def sync(current_user):
+    """Rows changed since the client's cursor: ?since=<seq>&limit=<n>.
+
+    Returns {'cursor', 'has_more', 'changes': {table: {'upserted': [...], 'deleted': [ids]}}}.
+    since=0 returns everything. Clients keep calling with the returned cursor while has_more is true.
+    Non-admins only get their own users row, like /api/users is admin only.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+
+    # Latest change of each row (SQLite returns the bare `op` column of the MAX(seq) row)
+    latest = db.session.query(
+        Change.table_name, Change.row_id, Change.op, func.max(Change.seq).label('seq')
+    ).filter(Change.seq > since).group_by(Change.table_name, Change.row_id).order_by(
+        text('seq')
+    ).limit(limit + 1).all()
+    has_more = len(latest) > limit
+    latest = latest[:limit]
+
+    changes = {}
+    for table_name in SYNC_MODELS:
+        rows = [r for r in latest if r.table_name == table_name]
+        if table_name == 'users' and current_user.role != 'admin':
+            rows = [r for r in rows if r.row_id == current_user.id]
+        if not rows:
+            continue
+        live_ids = [r.row_id for r in rows if r.op != 'DELETE']
+        upserted = sync_dicts(table_name, live_ids) if live_ids else []
+        found = {d['id'] for d in upserted}
+        changes[table_name] = {
+            'upserted': upserted,
+            'deleted': [r.row_id for r in rows if r.row_id not in found]
+        }
+
+    cursor = latest[-1].seq if latest else since
+    return jsonify({'cursor': cursor, 'has_more': has_more, 'changes': changes})
+
+# --- Server-Sent Events ---
+EVENTS_KEEPALIVE = 15 # Seconds between keepalive comments (proxies close silent connections)
+EVENTS_MAX_AGE = 300 # Seconds before a stream is closed; EventSource reconnects on its own
+EVENTS_TICKET_TTL = 30 # Seconds a stream ticket stays valid
+
+def event_stream(subscription):
+    try:
+        yield "retry: 3000\n\n"
+        deadline = time.monotonic() + EVENTS_MAX_AGE
+        while time.monotonic() < deadline:
+            try:
+                item = subscription.get(timeout=EVENTS_KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                break
+            name, data = item
+            yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+    finally:
+        event_broker.unsubscribe(subscription)
+
+@api.route('/api/events/ticket', methods=['POST'])
+@token_required
+def events_ticket(current_user):
+    """Issue a single-use ticket for one /api/events connection, valid EVENTS_TICKET_TTL seconds."""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    now = datetime.datetime.utcnow()
+    tickets = StreamTicket.__table__
+    db.session.execute(tickets.delete().where(
+        tickets.c.created_at < now - datetime.timedelta(seconds=EVENTS_TICKET_TTL)))
+    ticket = secrets.token_urlsafe(32)
+    db.session.execute(tickets.insert().values(ticket=ticket, user_id=current_user.id, created_at=now))
+    db.session.commit()
+    return jsonify({'ticket': ticket, 'expires_in': EVENTS_TICKET_TTL}), 201
+
+def redeem_stream_ticket(ticket):
+    """User of a valid ticket, which is used up; None if unknown, spent or expired."""
+    tickets = StreamTicket.__table__
+    row = db.session.execute(select(tickets.c.user_id).where(tickets.c.ticket == ticket)).first()
+    # The DELETE decides: of two connections racing with the same ticket, only one removes the row
+    spent = db.session.execute(tickets.delete().where(
+        tickets.c.ticket == ticket,
+        tickets.c.created_at >= datetime.datetime.utcnow() - datetime.timedelta(seconds=EVENTS_TICKET_TTL)
+    )).rowcount
+    db.session.commit()
+    return db.session.get(User, row.user_id) if row and spent else None
+
+@api.route('/api/events', methods=['GET'])
+def events():
+    """Stream entry_* and leave_* notifications (created, status, deleted) to an admin.
+
+    EventSource cannot send headers: the client first gets a ticket from
+    POST /api/events/ticket and connects with ?ticket=, so no token reaches the
+    access log. The stream holds no database connection (the session is released
+    when the view returns), and at most EVENTS_MAX_STREAMS streams run per process
+    so they never take every gthread slot; with GUNICORN_WORKER_CLASS=gevent the
+    limit can be raised.
+    """
+    current_user = redeem_stream_ticket(request.args.get('ticket', ''))
+    if not current_user:
+        return jsonify({'error': 'Stream ticket is invalid, used or expired'}), 401
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+
+    subscription = event_broker.subscribe(current_app.config['EVENTS_MAX_STREAMS'])
+    if subscription is None:
+        return jsonify({'error': 'Too many event streams'}), 503, {'Retry-After': '30'}
+    return current_app.response_class(event_stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # nginx: pass events through unbuffered
+    })
+
+# --- Group Commit ---
+
+class EntryWriter:
+    """Single writer thread that inserts queued entries in batches.
+
+    Request threads queue their entry and wait; the writer collects what arrives
+    within GROUP_COMMIT_WINDOW_MS and inserts it in one transaction, so a burst of
+    submissions costs one SQLite commit (WAL append + fsync) instead of one each.
+    """
+
+    def __init__(self, engine, window_ms, max_batch):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        threading.Thread(target=self.run, name='entry-writer', daemon=True).start()
+
+    def submit(self, values, timeout=None):
+        """Queue one entry (column values) and return its id once its batch is committed.
+
+        Raises FutureTimeoutError if the writer has not picked the entry up within
+        `timeout` seconds; the entry is then dropped. Once its batch is being written
+        the commit happens either way, so the caller waits for it rather than
+        reporting a failure for a row that ends up saved.
+        """
+        future = Future()
+        self.queue.put((values, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise
+        return future.result()
+
+    def run(self):
+        batch = []
+        while True:
+            try:
+                # Own connection, outside the pool the waiting request threads draw from
+                self.connection = self.engine.connect()
+                while True:
+                    batch = self.collect()
+                    if batch:
+                        self.flush(batch)
+            except Exception as e:
+                # The thread must outlive a broken connection, or every later submit would hang
+                logger.exception("Entry writer failed, reconnecting")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                batch = []
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+                time.sleep(1)
+
+    def collect(self):
+        """Wait for an entry, then take what arrives within the window. Timed out entries are skipped."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [(values, future) for values, future in batch if future.set_running_or_notify_cancel()]
+
+    def flush(self, batch):
+        try:
+            # ORM session (not a Core insert) so mapper events fire as for a normal add_entry
+            with Session(self.connection, expire_on_commit=False) as session:
+                entries = [Entry(**values) for values, _ in batch]
+                session.add_all(entries)
+                session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # One bad row must not fail the others: retry them one by one
+                logger.warning(f"Group commit of {len(batch)} entries failed ({e}), retrying individually")
+                for item in batch:
+                    self.flush([item])
+            return
+        for (_, future), entry in zip(batch, entries):
+            future.set_result(entry.id)
+
+_entry_writer_lock = threading.Lock()
+
+def get_entry_writer():
+    """The app's EntryWriter, started on first use (after gunicorn has forked)."""
+    app = current_app._get_current_object()
+    with _entry_writer_lock:
+        writer = app.extensions.get('entry_writer')
+        if writer is None:
+            writer = app.extensions['entry_writer'] = EntryWriter(
+                db.engine, app.config['GROUP_COMMIT_WINDOW_MS'], app.config['GROUP_COMMIT_MAX_BATCH'])
+    return writer
+
+def filter_entries(query, user_id=None):
+    """Apply the ?user_id=, ?from= and ?to= (inclusive, YYYY-MM-DD) filters of the request."""
+    user_id = user_id or request.args.get('user_id', type=int)
+    if user_id:
+        query = query.filter(Entry.user_id == user_id)
+    if request.args.get('from'):
+        query = query.filter(Entry.date >= request.args['from'])
+    if request.args.get('to'):
+        query = query.filter(Entry.date <= request.args['to'])
+    return query
+
+@api.route('/api/chantiers/<int:chantier_id>/entries', methods=['GET'])
 @token_required
 def get_chantier_entries(current_user, chantier_id):
-    # Everyone can see all entries for a chantier
-    entries = Entry.query.filter_by(chantier_id=chantier_id).all()
+    # Everyone can see all entries for a chantier; ?user_id= narrows it to one worker
+    entries = filter_entries(Entry.query.options(joinedload(Entry.user), joinedload(Entry.chantier)).filter_by(
+        chantier_id=chantier_id
+    )).all()
     return jsonify([e.to_dict() for e in entries])
 
-@app.route('/api/entries', methods=['POST'])
+@api.route('/api/entries', methods=['GET'])
 @token_required
+def list_entries(current_user):
+    """Timesheet of one worker: ?user_id= (default: the caller), ?from=, ?to=."""
+    user_id = request.args.get('user_id', current_user.id, type=int)
+    entries = filter_entries(Entry.query.options(joinedload(Entry.user), joinedload(Entry.chantier)),
+                             user_id=user_id).order_by(Entry.date, Entry.id).all()
+    return jsonify([e.to_dict() for e in entries])
+
+@api.route('/api/entries', methods=['POST'])
+@token_required
+@idempotent
 def add_entry(current_user):
     data = request.json
     
@@ -519,7 +2050,7 @@ def add_entry(current_user):
     # check role. Here we rely on frontend sending the correct user_id.
     # Status is consistently PENDING for new entries.
     
-    new_entry = Entry(
+    values = dict(
         user_id=data['user_id'],
         chantier_id=data['chantier_id'],
         date=data['date'],
@@ -528,18 +2059,28 @@ def add_entry(current_user):
         status='PENDING',
         created_by_id=data.get('created_by_id', data['user_id']) # Track who entered it
     )
-    db.session.add(new_entry)
-    db.session.commit()
+    if current_app.config['GROUP_COMMIT']:
+        # Returns once the batch holding this entry is committed; gives up well before gunicorn kills
+        # the request if the writer has not even started on it
+        try:
+            entry_id = get_entry_writer().submit(values, timeout=current_app.config['REQUEST_TIMEOUT'] / 2)
+        except FutureTimeoutError:
+            return jsonify({'error': 'Entry could not be saved in time, retry'}), 503, {'Retry-After': '5'}
+        new_entry = db.session.get(Entry, entry_id)
+    else:
+        new_entry = Entry(**values)
+        db.session.add(new_entry)
+        db.session.commit()
     return jsonify(new_entry.to_dict()), 201
 
-@app.route('/api/entries/pending', methods=['GET'])
+@api.route('/api/entries/pending', methods=['GET'])
 @token_required
 def get_pending_entries(current_user):
     # Admin only (frontend check generally, backend should check role ideally)
     entries = Entry.query.filter_by(status='PENDING').all()
     return jsonify([e.to_dict() for e in entries])
 
-@app.route('/api/entries/<int:entry_id>/validate', methods=['PUT'])
+@api.route('/api/entries/<int:entry_id>/validate', methods=['PUT'])
 @token_required
 def validate_entry(current_user, entry_id):
     entry = Entry.query.get(entry_id)
@@ -549,7 +2090,7 @@ def validate_entry(current_user, entry_id):
     db.session.commit()
     return jsonify(entry.to_dict())
 
-@app.route('/api/entries/<int:entry_id>', methods=['PUT', 'DELETE'])
+@api.route('/api/entries/<int:entry_id>', methods=['PUT', 'DELETE'])
 @token_required
 def manage_entry(current_user, entry_id):
     entry = Entry.query.get(entry_id)
@@ -568,13 +2109,16 @@ def manage_entry(current_user, entry_id):
         entry.materiel = float(data.get('materiel', entry.materiel))
         # If modified, does it stay validated? Let's assume yes or user keeps status.
         if 'status' in data:
+            if data['status'] not in ENTRY_STATUSES:
+                return jsonify({'error': f"status must be one of {', '.join(ENTRY_STATUSES)}"}), 400
             entry.status = data['status']
             
         db.session.commit()
         return jsonify(entry.to_dict())
 
-@app.route('/api/leaves', methods=['GET', 'POST'])
+@api.route('/api/leaves', methods=['GET', 'POST'])
 @token_required
+@idempotent
 def manage_leaves(current_user):
     if request.method == 'GET':
         user_id = request.args.get('user_id')
@@ -598,7 +2142,7 @@ def manage_leaves(current_user):
         db.session.commit()
         return jsonify(new_leave.to_dict()), 201
 
-@app.route('/api/leaves/<int:leave_id>/status', methods=['PUT'])
+@api.route('/api/leaves/<int:leave_id>/status', methods=['PUT'])
 @token_required
 def update_leave_status(current_user, leave_id):
     leave = Leave.query.get(leave_id)
@@ -623,8 +2167,9 @@ def update_leave_status(current_user, leave_id):
     db.session.commit()
     return jsonify(leave.to_dict())
 
-@app.route('/api/chantiers/<int:chantier_id>/alerts', methods=['GET', 'POST'])
+@api.route('/api/chantiers/<int:chantier_id>/alerts', methods=['GET', 'POST'])
 @token_required
+@idempotent
 def manage_alerts(current_user, chantier_id):
     if request.method == 'GET':
         alerts = Alert.query.filter_by(chantier_id=chantier_id).all()
@@ -643,7 +2188,7 @@ def manage_alerts(current_user, chantier_id):
         db.session.commit()
         return jsonify(new_alert.to_dict()), 201
 
-@app.route('/api/alerts/<int:alert_id>', methods=['PUT', 'DELETE'])
+@api.route('/api/alerts/<int:alert_id>', methods=['PUT', 'DELETE'])
 @token_required
 def manage_single_alert(current_user, alert_id):
     alert = Alert.query.get(alert_id)
@@ -661,10 +2206,131 @@ def manage_single_alert(current_user, alert_id):
         db.session.commit()
         return jsonify(alert.to_dict())
 
-@app.route('/api/export', methods=['GET'])
+def entry_in_period(date, year, semester):
+    """Date format YYYY-MM-DD. year: '2024', semester: 'S1' / 'S2' (both optional)."""
+    if year and not date.startswith(str(year)):
+        return False
+    if semester:
+        try:
+            month = int(date.split('-')[1])
+            if semester == 'S1' and month > 6:
+                return False
+            if semester == 'S2' and month <= 6:
+                return False
+        except:
+            pass # potentially malformed date
+    return True
+
+EXPORT_HEADER = ['ID', 'Date', 'Chantier', 'Ouvrier', 'Heures', 'Materiel', 'Statut']
+EXPORT_FORMATS = {'csv': 'text/csv'}
+if HAS_PYARROW:
+    EXPORT_FORMATS.update({'parquet': 'application/vnd.apache.parquet',
+                           'arrow': 'application/vnd.apache.arrow.file'})
+EXPORT_BATCH_ROWS = 65536 # Rows per record batch (one Parquet row group each)
+
+def export_rows(chantier_id=None, year=None, semester=None, archived=False):
+    """Export rows [id, date, chantier, ouvrier, heures, materiel, statut], streamed from SQL."""
+    sql = ("SELECT e.id, e.date, COALESCE(c.nom, 'Supprimé'), COALESCE(u.username, 'Inconnu'), "
+           "e.heures, e.materiel, e.status FROM entries e "
+           "LEFT JOIN chantiers c ON c.id = e.chantier_id LEFT JOIN users u ON u.id = e.user_id")
+    where = []
+    params = {}
+    if chantier_id:
+        where.append("e.chantier_id = :chantier_id")
+        params['chantier_id'] = chantier_id
+    if year and re.fullmatch(r'\d{4}', str(year)):
+        # Same as date.startswith(year), on the date index
+        where.append("e.date >= :year AND e.date < :next_year")
+        params.update(year=str(year), next_year=str(int(year) + 1))
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with db.engine.connect() as conn:
+        for row in conn.execute(text(sql + " ORDER BY e.id"), params):
+            # Semesters (and malformed dates) are checked in Python
+            if entry_in_period(row[1], year, semester):
+                yield list(row)
+    # ?archived=1 also exports entries of archived chantiers
+    if archived:
+        yield from (r for r in archived_entry_rows(chantier_id) if entry_in_period(r[1], year, semester))
+
+def export_filename(chantier_id=None, year=None, semester=None, extension='csv'):
+    parts = ["export"]
+    if chantier_id: parts.append(f"chantier_{chantier_id}")
+    else: parts.append("global")
+    
+    if year: parts.append(str(year))
+    if semester: parts.append(semester)
+    
+    return "_".join(parts) + f".{extension}"
+
+def parse_date(value):
+    """datetime.date of a YYYY-MM-DD string, None when malformed."""
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return None
+
+class ExportBuffer:
+    """Write-only file object for the columnar writers; take() returns what was written since the last call."""
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def write_columnar(sink, rows, export_format):
+    """Write export rows to sink as Parquet or Arrow IPC (file format), in record batches of
+    EXPORT_BATCH_ROWS with typed columns. Yields after each batch and after the footer, so a
+    streaming caller can pass on what was written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([('ID', pa.int64()), ('Date', pa.date32()), ('Chantier', pa.string()),
+                        ('Ouvrier', pa.string()), ('Heures', pa.float64()), ('Materiel', pa.float64()),
+                        ('Statut', pa.string())])
+    # zstd: repeated chantier / worker names compress well and both formats decode it natively
+    if export_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    rows = iter(rows)
+    with writer:
+        while chunk := list(itertools.islice(rows, EXPORT_BATCH_ROWS)):
+            ids, dates, chantiers, users, hours, material, statuses = zip(*chunk)
+            writer.write_batch(pa.record_batch([
+                pa.array(ids, pa.int64()),
+                pa.array([parse_date(d) for d in dates], pa.date32()),
+                pa.array(chantiers, pa.string()),
+                pa.array(users, pa.string()),
+                pa.array(hours, pa.float64()),
+                pa.array(material, pa.float64()),
+                pa.array(statuses, pa.string()),
+            ], schema=schema))
+            yield
+    yield
+
+@api.route('/api/export', methods=['GET'])
 @token_required
 def export_data(current_user):
-    # Export entries to CSV
+    # Export entries to CSV, or ?format=parquet / arrow (streamed)
     import csv
     import io
     from flask import make_response
@@ -672,89 +2338,199 @@ def export_data(current_user):
     chantier_id = request.args.get('chantier_id')
     year = request.args.get('year')
     semester = request.args.get('semester') # S1, S2
-    
-    query = Entry.query
-    
-    if chantier_id:
-        query = query.filter_by(chantier_id=chantier_id)
-        
-    entries = query.all()
-    
-    # Filter in Python for simplicity with string dates
-    filtered_entries = []
-    for e in entries:
-        include = True
-        
-        # Date format YYYY-MM-DD
-        if year:
-            if not e.date.startswith(str(year)):
-                include = False
-                
-        if semester and include:
-            try:
-                month = int(e.date.split('-')[1])
-                if semester == 'S1':
-                    if month > 6: include = False
-                elif semester == 'S2':
-                    if month <= 6: include = False
-            except:
-                pass # potentially malformed date
-                
-        if include:
-            filtered_entries.append(e)
+    archived = request.args.get('archived') == '1'
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    filename = export_filename(chantier_id, year, semester, export_format)
+
+    if export_format != 'csv':
+        rows = export_rows(chantier_id, year, semester, archived)
+
+        def generate():
+            buffer = ExportBuffer()
+            for _ in write_columnar(buffer, rows, export_format):
+                yield buffer.take()
+
+        # stream_with_context: export_rows reads through the app's engine while streaming
+        output = current_app.response_class(stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format])
+        output.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return output
     
     # Create CSV in memory
     si = io.StringIO()
     cw = csv.writer(si)
     # Headers
-    cw.writerow(['ID', 'Date', 'Chantier', 'Ouvrier', 'Heures', 'Materiel', 'Statut'])
-    
-    for e in filtered_entries:
-        cw.writerow([
-            e.id, 
-            e.date, 
-            e.chantier.nom if e.chantier else 'Supprimé', 
-            e.user.username if e.user else 'Inconnu', 
-            e.heures, 
-            e.materiel,
-            e.status
-        ])
+    cw.writerow(EXPORT_HEADER)
+    cw.writerows(export_rows(chantier_id, year, semester, archived))
     
     output = make_response(si.getvalue())
     
-    # Filename construction
-    parts = ["export"]
-    if chantier_id: parts.append(f"chantier_{chantier_id}")
-    else: parts.append("global")
-    
-    if year: parts.append(str(year))
-    if semester: parts.append(semester)
-    
-    filename = "_".join(parts) + ".csv"
-    
     output.headers["Content-Disposition"] = f"attachment; filename={filename}"
     output.headers["Content-type"] = "text/csv"
     return output
 
-@app.route('/api/stats', methods=['GET'])
+# --- Export Jobs ---
+# POST /api/exports builds the file in a background thread; GET /api/exports/<id> answers
+# 202 while it runs, then sends it. Files stay under uploads/exports/<id>/<filename>, the
+# id being a hash of the filters and the data version: the same export asked again before
+# any write is a plain file download.
+_export_pool = None
+_export_jobs = {}  # export id -> Future, kept after a failure to report it
+_export_lock = threading.Lock()
+
+def export_filters(data):
+    """Normalized filters of an export request: chantier_id, year, semester, archived, format. Raises ValueError."""
+    chantier_id = int(data['chantier_id']) if data.get('chantier_id') else None
+    year = str(int(data['year'])) if data.get('year') else None
+    semester = data.get('semester') or None
+    if semester not in (None, 'S1', 'S2'):
+        raise ValueError('semester must be S1 or S2')
+    export_format = data.get('format') or 'csv'
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    return {'chantier_id': chantier_id, 'year': year, 'semester': semester,
+            'archived': data.get('archived') in (True, 1, '1'), 'format': export_format}
+
+def export_folder():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'exports')
+
+def write_export(path, filters):
+    import csv
+    rows = export_rows(filters['chantier_id'], filters['year'], filters['semester'], filters['archived'])
+    if filters['format'] != 'csv':
+        with open(path, 'wb') as f:
+            for _ in write_columnar(f, rows, filters['format']):
+                pass
+        return
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_HEADER)
+        writer.writerows(rows)
+
+def run_export(app, export_id, filters):
+    """Build an export file. Runs in the export pool."""
+    with app.app_context():
+        out_dir = os.path.join(export_folder(), export_id)
+        tmp_dir = f"{out_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            filename = export_filename(filters['chantier_id'], filters['year'], filters['semester'], filters['format'])
+            write_export(os.path.join(tmp_dir, filename), filters)
+            # Directory rename is atomic: out_dir existing means the file is complete
+            os.rename(tmp_dir, out_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        prune_exports(app.config['EXPORT_RETENTION_HOURS'])
+
+def prune_exports(retention_hours):
+    """Delete finished exports older than retention_hours (newer data gives new ids anyway)."""
+    folder = export_folder()
+    cutoff = time.time() - retention_hours * 3600
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if not name.endswith('.tmp') and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+def get_export_pool():
+    global _export_pool
+    with _export_lock:
+        if _export_pool is None:
+            # Threads, not processes: the job reads SQLite through the app's engine
+            _export_pool = ThreadPoolExecutor(max_workers=current_app.config['EXPORT_WORKERS'],
+                                              thread_name_prefix='export')
+        return _export_pool
+
+def schedule_export(export_id, filters):
+    """Queue an export unless its file exists or it is already running (failed ones are retried)."""
+    if os.path.isdir(os.path.join(export_folder(), export_id)):
+        return 'done'
+    os.makedirs(export_folder(), exist_ok=True)
+    pool = get_export_pool()
+    app = current_app._get_current_object()
+
+    def on_done(future):
+        if future.exception():
+            logger.error(f"Export {export_id} failed: {future.exception()}")
+            return
+        with _export_lock:
+            _export_jobs.pop(export_id, None)
+
+    with _export_lock:
+        future = _export_jobs.get(export_id)
+        if future is not None and not (future.done() and future.exception()):
+            return 'pending'
+        future = _export_jobs[export_id] = pool.submit(run_export, app, export_id, filters)
+    future.add_done_callback(on_done)
+    return 'pending'
+
+@api.route('/api/exports', methods=['POST'])
+@token_required
+def create_export(current_user):
+    """Queue an export: {chantier_id, year, semester: S1|S2, archived, format: csv|parquet|arrow} (all optional)."""
+    try:
+        filters = export_filters(request.json or {})
+    except ValueError as e:
+        return jsonify({'error': f'Invalid export filters: {e}'}), 400
+    key = json.dumps({**filters, 'version': data_version()}, sort_keys=True)
+    export_id = hashlib.sha256(key.encode()).hexdigest()[:32]
+    status = schedule_export(export_id, filters)
+    return jsonify({'id': export_id, 'status': status}), 200 if status == 'done' else 202
+
+@api.route('/api/exports/<export_id>', methods=['GET'])
 @token_required
+def get_export(current_user, export_id):
+    """The export file once built; 202 {'status': 'pending'} until then."""
+    if not re.fullmatch(r'[0-9a-f]{32}', export_id):
+        return jsonify({'error': 'Export not found'}), 404
+    out_dir = os.path.join(export_folder(), export_id)
+    if os.path.isdir(out_dir):
+        filename = os.listdir(out_dir)[0]
+        mimetype = EXPORT_FORMATS[filename.rsplit('.', 1)[-1]]
+        response = send_upload(os.path.join('exports', export_id, filename), etag=export_id, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f"attachment; filename={filename}"
+        return response
+    with _export_lock:
+        future = _export_jobs.get(export_id)
+    if future is None:
+        return jsonify({'error': 'Export not found'}), 404
+    if future.done() and future.exception():
+        return jsonify({'status': 'failed', 'error': str(future.exception())}), 500
+    return jsonify({'status': 'pending'}), 202
+
+@api.route('/api/stats', methods=['GET'])
+@token_required
+@cached_result
 def get_stats(current_user):
     from sqlalchemy import func
     from datetime import datetime, timedelta
     from collections import defaultdict
     
-    total_entries = db.session.query(func.count(Entry.id)).scalar() or 0
-    total_hours = db.session.query(func.sum(Entry.heures)).scalar() or 0
-    total_material = db.session.query(func.sum(Entry.materiel)).scalar() or 0
+    columns = get_entry_columns()
+    if columns is not None:
+        totals = columns.totals()
+        monthly_data = columns.group_by('month')
+    else:
+        totals = {
+            'entries': db.session.query(func.count(Entry.id)).scalar() or 0,
+            'hours': db.session.query(func.sum(Entry.heures)).scalar() or 0,
+            'material': db.session.query(func.sum(Entry.materiel)).scalar() or 0
+        }
+        month = func.substr(Entry.date, 1, 7)
+        monthly_data = {
+            row.month: {'hours': row.hours, 'material': row.material}
+            for row in db.session.query(month.label('month'), func.sum(Entry.heures).label('hours'),
+                                        func.sum(Entry.materiel).label('material')).group_by(month)
+        }
+    total_entries = totals['entries']
+    total_hours = totals['hours']
+    total_material = totals['material']
     
     # Active chantiers count
     active_chantiers = db.session.query(func.count(Chantier.id)).filter(Chantier.status == 'ACTIVE').scalar() or 0
     
-    # History Processing (Last 12 Months)
-    entries = Entry.query.all()
-    
-    # Group by Month and Year for Comparison
-    monthly_data = defaultdict(lambda: {'hours': 0, 'material': 0})
+    # Month and Year for Comparison
     current_year = datetime.now().year
     last_year = current_year - 1
     
@@ -763,23 +2539,19 @@ def get_stats(current_user):
     total_mat_curr = 0
     total_mat_last = 0
 
-    for e in entries:
+    for month_key, sums in list(monthly_data.items()):
         try:
-            # Assumes e.date is YYYY-MM-DD
-            year = int(e.date[:4])
-            month_key = e.date[:7] # YYYY-MM
-            
-            monthly_data[month_key]['hours'] += e.heures
-            monthly_data[month_key]['material'] += e.materiel
-            
-            if year == current_year:
-                total_hours_curr += e.heures
-                total_mat_curr += e.materiel
-            elif year == last_year:
-                total_hours_last += e.heures
-                total_mat_last += e.materiel
-        except:
+            # Assumes dates are YYYY-MM-DD
+            year = int(month_key[:4])
+        except ValueError:
+            del monthly_data[month_key]
             continue
+        if year == current_year:
+            total_hours_curr += sums['hours']
+            total_mat_curr += sums['material']
+        elif year == last_year:
+            total_hours_last += sums['hours']
+            total_mat_last += sums['material']
             
     # Format for Frontend (Sorted keys)
     sorted_months = sorted(monthly_data.keys())[-12:] # Last 12 months
@@ -815,8 +2587,523 @@ def get_stats(current_user):
         }
     })
 
-# Initialize Database (Run migration)
-init_db()
+# --- Reports ---
+
+# One row per (user, day, chantier). Weekly figures are computed over whole Monday-Sunday
+# weeks, including the days of a boundary week that fall outside the requested range, so a
+# week split across two months gets its overtime right. Overtime is counted on the day the
+# weekly threshold is crossed and every day after it.
+PAYROLL_SQL = """
+WITH per_chantier AS (
+    SELECT user_id, date, date(date, 'weekday 0', '-6 days') AS week_start, chantier_id,
+        SUM(heures) AS hours, SUM(materiel) AS material
+    FROM entries
+    WHERE date BETWEEN date(:date_from, 'weekday 0', '-6 days') AND date(:date_to, 'weekday 0')
+      AND (:status = 'ALL' OR status = :status)
+    GROUP BY user_id, date, chantier_id
+),
+windowed AS (
+    SELECT *,
+        SUM(hours) OVER (PARTITION BY user_id, date) AS day_hours,
+        SUM(hours) OVER (PARTITION BY user_id, week_start) AS week_hours,
+        -- Default frame (RANGE ... CURRENT ROW) includes the other chantiers of the same day
+        SUM(hours) OVER (PARTITION BY user_id, week_start ORDER BY date) AS week_to_date
+    FROM per_chantier
+)
+SELECT w.user_id, u.username, w.date, w.week_start, w.chantier_id, COALESCE(c.nom, 'Supprimé') AS chantier_nom,
+    w.hours, w.material, w.day_hours, w.week_hours,
+    MAX(0.0, w.week_hours - :threshold) AS week_overtime,
+    MAX(0.0, w.week_to_date - :threshold) - MAX(0.0, w.week_to_date - w.day_hours - :threshold) AS day_overtime,
+    SUM(w.hours) OVER (PARTITION BY w.user_id, w.chantier_id) AS user_chantier_hours
+FROM windowed w
+JOIN users u ON u.id = w.user_id
+LEFT JOIN chantiers c ON c.id = w.chantier_id
+WHERE w.date BETWEEN :date_from AND :date_to
+ORDER BY u.username, w.user_id, w.date, chantier_nom
+"""
+
+PAYROLL_CSV_HEADER = ['Ouvrier', 'Date', 'Semaine', 'Chantier', 'Heures', 'Materiel',
+                      'Heures jour', 'Heures semaine', 'Heures sup. jour']
+
+def report_period():
+    """?from= and ?to= (YYYY-MM-DD, inclusive), defaulting to the current month. Raises ValueError."""
+    today = datetime.date.today()
+    date_from = datetime.date.fromisoformat(request.args.get('from') or today.replace(day=1).isoformat())
+    if request.args.get('to'):
+        date_to = datetime.date.fromisoformat(request.args['to'])
+    else:
+        next_month = (date_from.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        date_to = next_month - datetime.timedelta(days=1)
+    if date_to < date_from:
+        raise ValueError('to is before from')
+    return date_from.isoformat(), date_to.isoformat()
+
+def payroll_summary(rows):
+    """Nest the report rows (ordered by user, date) into one summary per user."""
+    users = []
+    for row in rows:
+        if not users or users[-1]['user_id'] != row.user_id:
+            users.append({'user_id': row.user_id, 'username': row.username, 'hours': 0, 'overtime': 0,
+                          'material': 0, 'chantiers': {}, 'weeks': {}, 'days': []})
+        user = users[-1]
+        if not user['days'] or user['days'][-1]['date'] != row.date:
+            user['days'].append({'date': row.date, 'hours': row.day_hours, 'overtime': row.day_overtime,
+                                 'chantiers': []})
+            user['hours'] += row.day_hours
+            user['overtime'] += row.day_overtime
+            user['weeks'][row.week_start] = {'week_start': row.week_start, 'hours': row.week_hours,
+                                             'overtime': row.week_overtime}
+        user['days'][-1]['chantiers'].append({'chantier_id': row.chantier_id, 'chantier_nom': row.chantier_nom,
+                                              'hours': row.hours, 'material': row.material})
+        user['material'] += row.material
+        user['chantiers'][row.chantier_id] = {'chantier_id': row.chantier_id, 'chantier_nom': row.chantier_nom,
+                                              'hours': row.user_chantier_hours}
+    for user in users:
+        user['hours'] = round(user['hours'], 2)
+        user['overtime'] = round(user['overtime'], 2)
+        user['material'] = round(user['material'], 2)
+        user['chantiers'] = sorted(user['chantiers'].values(), key=lambda c: -c['hours'])
+        user['weeks'] = list(user['weeks'].values())
+    return users
+
+@api.route('/api/reports/payroll', methods=['GET'])
+@token_required
+@cached_result
+def payroll_report(current_user):
+    """Per-user daily and weekly hours, overtime and per-chantier split for a period.
+
+    ?from=&to= (default: current month), ?status=VALIDATED (default) or ALL,
+    ?threshold= weekly hours (default PAYROLL_WEEKLY_HOURS), ?format=csv for a streamed CSV.
+    Week figures (week_hours, week overtime) cover the whole Monday-Sunday week.
+    """
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    try:
+        date_from, date_to = report_period()
+        threshold = float(request.args.get('threshold', current_app.config['PAYROLL_WEEKLY_HOURS']))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid period or threshold: {e}'}), 400
+    status = request.args.get('status', 'VALIDATED').upper()
+    params = {'date_from': date_from, 'date_to': date_to, 'status': status, 'threshold': threshold}
+
+    if request.args.get('format') == 'csv':
+        import csv
+        import io
+        engine = db.engine
+
+        def generate():
+            # Own connection: the request's session and app context are gone once streaming starts
+            with engine.connect() as conn:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(PAYROLL_CSV_HEADER)
+                for row in conn.execute(text(PAYROLL_SQL), params):
+                    writer.writerow([row.username, row.date, row.week_start, row.chantier_nom, row.hours,
+                                     row.material, row.day_hours, row.week_hours, row.day_overtime])
+                    if buffer.tell() > 64 * 1024:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+
+        return current_app.response_class(generate(), mimetype='text/csv', headers={
+            'Content-Disposition': f"attachment; filename=payroll_{date_from}_{date_to}.csv"
+        })
+
+    rows = db.session.execute(text(PAYROLL_SQL), params).all()
+    return jsonify({
+        'from': date_from,
+        'to': date_to,
+        'status': status,
+        'weekly_threshold': threshold,
+        'users': payroll_summary(rows)
+    })
+
+# Costs are computed from entries summed per (chantier, worker, validated), so the role/rate
+# lookup runs once per group instead of once per entry; then everything is rolled up per chantier.
+# All-time groups come straight from entry_totals; a period has to group the entries in range.
+CHANTIER_COSTS_SQL = """
+WITH rates(role, rate) AS ({rates}),
+grouped AS ({grouped}),
+costs AS (
+    SELECT g.chantier_id,
+        SUM(CASE WHEN g.validated THEN g.hours ELSE 0 END) AS hours_validated,
+        SUM(CASE WHEN g.validated THEN 0 ELSE g.hours END) AS hours_pending,
+        SUM(CASE WHEN g.validated THEN g.material ELSE 0 END) AS material_validated,
+        SUM(CASE WHEN g.validated THEN 0 ELSE g.material END) AS material_pending,
+        SUM(CASE WHEN g.validated THEN g.hours * COALESCE(r.rate, :default_rate) ELSE 0 END) AS labor_cost_validated,
+        SUM(CASE WHEN g.validated THEN 0 ELSE g.hours * COALESCE(r.rate, :default_rate) END) AS labor_cost_pending
+    FROM grouped g
+    LEFT JOIN users u ON u.id = g.user_id
+    LEFT JOIN rates r ON r.role = u.role
+    GROUP BY g.chantier_id
+)
+SELECT c.id, c.nom, c.status, c.budget, costs.*
+FROM chantiers c
+LEFT JOIN costs ON costs.chantier_id = c.id
+{status_filter}
+ORDER BY c.nom
+"""
+
+COST_FIELDS = ['hours_validated', 'hours_pending', 'material_validated', 'material_pending',
+               'labor_cost_validated', 'labor_cost_pending']
+
+@api.route('/api/reports/chantiers', methods=['GET'])
+@token_required
+@cached_result
+def chantier_cost_report(current_user):
+    """Per-chantier hours, material and labor cost (validated / pending) and margin against the budget.
+
+    Labor cost is hours x the worker's role rate (HOURLY_RATES). Costs and margin only
+    count VALIDATED entries; the *_pending fields show what is still waiting.
+    ?status=ACTIVE filters chantiers, ?from=&to= restricts the entry dates (default: all).
+    """
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    rates = current_app.config['HOURLY_RATES']
+    # Role names are bound as parameters too: VALUES (:role_0, :rate_0), ...
+    params = {'default_rate': rates.get('user', 0)}
+    values = []
+    for i, (role, rate) in enumerate(rates.items()):
+        params[f'role_{i}'], params[f'rate_{i}'] = role, rate
+        values.append(f'(:role_{i}, :rate_{i})')
+    date_filter = []
+    if request.args.get('from'):
+        date_filter.append('date >= :date_from')
+        params['date_from'] = request.args['from']
+    if request.args.get('to'):
+        date_filter.append('date <= :date_to')
+        params['date_to'] = request.args['to']
+    status_filter = ''
+    status = request.args.get('status')
+    if status and status != 'ALL':
+        status_filter = 'WHERE c.status = :status'
+        params['status'] = status
+    if date_filter:
+        grouped = (f"SELECT chantier_id, user_id, COALESCE(status = 'VALIDATED', 0) AS validated, SUM(heures) AS hours, "
+                   f"SUM(materiel) AS material FROM entries WHERE {' AND '.join(date_filter)} "
+                   f"GROUP BY chantier_id, user_id, validated")
+    else:
+        grouped = "SELECT chantier_id, user_id, validated, hours, material FROM entry_totals"
+    sql = CHANTIER_COSTS_SQL.format(rates='VALUES ' + ', '.join(values) if values else 'SELECT NULL, NULL',
+                                    grouped=grouped, status_filter=status_filter)
+
+    chantiers = []
+    totals = dict.fromkeys(COST_FIELDS + ['total_cost', 'budget'], 0.0)
+    for row in db.session.execute(text(sql), params).mappings():
+        item = {'chantier_id': row['id'], 'nom': row['nom'], 'status': row['status'], 'budget': row['budget']}
+        for field in COST_FIELDS:
+            item[field] = round(float(row[field] or 0), 2)
+            totals[field] += item[field]
+        item['total_cost'] = round(item['labor_cost_validated'] + item['material_validated'], 2)
+        totals['total_cost'] += item['total_cost']
+        if row['budget']:
+            item['margin'] = round(row['budget'] - item['total_cost'], 2)
+            item['budget_used_pct'] = round(item['total_cost'] / row['budget'] * 100, 1)
+            totals['budget'] += row['budget']
+        else:
+            item['margin'] = item['budget_used_pct'] = None
+        chantiers.append(item)
+
+    return jsonify({
+        'hourly_rates': rates,
+        'chantiers': chantiers,
+        'totals': {key: round(value, 2) for key, value in totals.items()}
+    })
+
+# --- Cold Data Archive ---
+# DONE chantiers (with their entries, alerts, document rows and members) are moved into data/archive/archive_<year>.db,
+# <year> being the year the chantier ended. Archive files are only ATTACHed when archived data is requested.
+ARCHIVE_TABLES = [('chantiers', 'id'), ('entries', 'chantier_id'), ('alerts', 'chantier_id'),
+                  ('documents', 'chantier_id'), ('chantier_members', 'chantier_id')]
+
+# End date of a chantier, falling back to the end of its year
+ARCHIVE_END_DATE_SQL = "COALESCE(NULLIF(main.chantiers.date_end, ''), main.chantiers.annee || '-12-31')"
+
+def archive_path(year):
+    return os.path.join(current_app.config['ARCHIVE_FOLDER'], f'archive_{year}.db')
+
+def archive_years(chantier_id=None):
+    query = db.session.query(ArchivedChantier.year).distinct()
+    if chantier_id:
+        query = query.filter(ArchivedChantier.id == chantier_id)
+    return [year for (year,) in query.order_by(ArchivedChantier.year)]
+
+@contextmanager
+def attached_archive(year):
+    """Connection with archive_<year>.db attached as `archive`."""
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (archive_path(year),))
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql("DETACH DATABASE archive")
+
+def table_columns(conn, schema, table):
+    return [(row[1], row[2]) for row in conn.exec_driver_sql(f"PRAGMA {schema}.table_info({table})")]
+
+def ensure_archive_schema(conn):
+    """Create (or catch up) the archive tables and indexes from the live schema."""
+    for table, _ in ARCHIVE_TABLES:
+        create_sql = conn.exec_driver_sql(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).scalar()
+        conn.exec_driver_sql(re.sub(r'^CREATE TABLE "?\w+"?', f'CREATE TABLE IF NOT EXISTS archive.{table}', create_sql))
+
+        # Columns added to the live table after this archive file was created
+        archived = {name for name, _ in table_columns(conn, 'archive', table)}
+        for name, col_type in table_columns(conn, 'main', table):
+            if name not in archived:
+                conn.exec_driver_sql(f"ALTER TABLE archive.{table} ADD COLUMN {name} {col_type}")
+
+        indexes = conn.exec_driver_sql(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,)).scalars().all()
+        for index_sql in indexes:
+            conn.exec_driver_sql(re.sub(r'^CREATE (UNIQUE )?INDEX "?(\w+)"?',
+                                        r'CREATE \1INDEX IF NOT EXISTS archive.\2', index_sql))
+    conn.commit()
+
+def archive_done_chantiers(months):
+    """Move DONE chantiers that ended more than `months` ago into the yearly archive files."""
+    cutoff = (datetime.date.today() - datetime.timedelta(days=months * 30)).isoformat()
+    os.makedirs(current_app.config['ARCHIVE_FOLDER'], exist_ok=True)
+    year_sql = f"CAST(substr({ARCHIVE_END_DATE_SQL}, 1, 4) AS INTEGER)"
+    selected = (f"SELECT main.chantiers.id FROM main.chantiers WHERE main.chantiers.status = 'DONE' "
+                f"AND {ARCHIVE_END_DATE_SQL} < :cutoff AND {year_sql} = :year")
+
+    years = db.session.execute(text(
+        f"SELECT DISTINCT {year_sql} FROM main.chantiers "
+        f"WHERE main.chantiers.status = 'DONE' AND {ARCHIVE_END_DATE_SQL} < :cutoff"
+    ), {'cutoff': cutoff}).scalars().all()
+    db.session.rollback()
+
+    moved = {}
+    for year in years:
+        try:
+            with attached_archive(year) as conn:
+                ensure_archive_schema(conn)
+                params = {'cutoff': cutoff, 'year': year}
+                # One transaction per year: copy into the archive, then delete from the hot database.
+                # (In WAL mode a crash in between can leave a copy in the archive: rows of the chantiers
+                # being archived are still authoritative in the hot database and replace it.)
+                count = len(conn.execute(text(selected), params).all())
+                for table, key in ARCHIVE_TABLES:
+                    cols = ', '.join(name for name, _ in table_columns(conn, 'main', table))
+                    conn.execute(text(f"DELETE FROM archive.{table} WHERE {key} IN ({selected})"), params)
+                    # Plain INSERT: an id already used by another archived chantier aborts the year
+                    conn.execute(text(f"INSERT INTO archive.{table} ({cols}) "
+                                      f"SELECT {cols} FROM main.{table} WHERE {key} IN ({selected})"), params)
+                conn.execute(text(f"INSERT OR REPLACE INTO main.archived_chantiers (id, year, archived_at) "
+                                  f"SELECT id, :year, CURRENT_TIMESTAMP FROM ({selected})"), params)
+                # Synced clients drop archived rows like deleted ones
+                for table, key in ARCHIVE_TABLES:
+                    if table in SYNC_MODELS:
+                        conn.execute(text(f"INSERT INTO main.changes (table_name, row_id, op) "
+                                          f"SELECT '{table}', id, 'DELETE' FROM main.{table} WHERE {key} IN ({selected})"), params)
+                # Children first, the chantier rows are what `selected` reads
+                for table, key in reversed(ARCHIVE_TABLES):
+                    conn.execute(text(f"DELETE FROM main.{table} WHERE {key} IN ({selected})"), params)
+                conn.commit()
+        except IntegrityError as e:
+            # Ids already present in the archive file (rows archived before ids stopped being reused)
+            logger.error(f"Archiving into {archive_path(year)} aborted, nothing moved for {year}: {e}")
+            continue
+        moved[year] = count
+        logger.info(f"Archived {count} chantier(s) into {archive_path(year)}")
+    # The DELETE changes logged above take the archived entries out of the entry columns
+    return moved
+
+def archived_chantier_dicts(status=None, totals=False):
+    """Chantiers from every archive file, shaped like Chantier.to_dict() (plus 'totals' if asked)."""
+    result = []
+    for year in archive_years():
+        with attached_archive(year) as conn:
+            sql = "SELECT * FROM archive.chantiers"
+            if status:
+                sql += " WHERE status = :status"
+            rows = conn.execute(text(sql), {'status': status}).mappings().all()
+            members = defaultdict(list)
+            for chantier_id, user_id in conn.exec_driver_sql(
+                    "SELECT chantier_id, user_id FROM archive.chantier_members ORDER BY chantier_id, user_id"):
+                members[chantier_id].append(user_id)
+            entry_sums = {}
+            if totals:
+                for chantier_id, entries, hours, material, pending in conn.exec_driver_sql(
+                        "SELECT chantier_id, COUNT(*), SUM(heures), SUM(materiel), "
+                        "SUM(COALESCE(status != 'VALIDATED', 1)) FROM archive.entries GROUP BY chantier_id"):
+                    entry_sums[chantier_id] = {'entries': entries, 'hours': round(hours or 0, 1),
+                                               'material': round(material or 0, 2), 'pending': pending}
+        for row in rows:
+            result.append({
+                'id': row['id'],
+                'nom': row['nom'],
+                'annee': row['annee'],
+                'plan_pdf_path': row.get('plan_pdf_path'),
+                'pdf_path': row.get('pdf_path'),
+                'address_work': row.get('address_work'),
+                'address_billing': row.get('address_billing'),
+                'date_start': row.get('date_start'),
+                'date_end': row.get('date_end'),
+                'remarque': row.get('remarque'),
+                'status': row['status'],
+                'budget': row.get('budget'),
+                'members': members[row['id']],
+                'archived': True,
+                'archive_year': year,
+                **({'totals': entry_sums.get(row['id'], {'entries': 0, 'hours': 0, 'material': 0, 'pending': 0})}
+                   if totals else {})
+            })
+    return result
+
+def archived_entry_rows(chantier_id=None):
+    """Archived entries as export rows: [id, date, chantier, ouvrier, heures, materiel, statut]."""
+    rows = []
+    for year in archive_years(chantier_id):
+        with attached_archive(year) as conn:
+            sql = ("SELECT e.id, e.date, COALESCE(c.nom, 'Supprimé'), COALESCE(u.username, 'Inconnu'), "
+                   "e.heures, e.materiel, e.status FROM archive.entries e "
+                   "LEFT JOIN archive.chantiers c ON c.id = e.chantier_id "
+                   "LEFT JOIN main.users u ON u.id = e.user_id")
+            if chantier_id:
+                sql += " WHERE e.chantier_id = :chantier_id"
+            rows += [list(r) for r in conn.execute(text(sql), {'chantier_id': chantier_id})]
+    return rows
+
+BLOB_GC_GRACE = 3600 # Seconds: a younger blob may belong to an upload whose row is not committed yet
+
+def referenced_blobs():
+    """sha256 of every blob a document or chantier plan points to, in chantier.db or an archive file."""
+    used = set(db.session.execute(select(Document.sha256)).scalars())
+    used.update(db.session.execute(
+        select(Chantier.plan_pdf_sha256).where(Chantier.plan_pdf_sha256.isnot(None))).scalars())
+    years = archive_years()
+    db.session.rollback()
+    for year in years:
+        with attached_archive(year) as conn:
+            for table, column in (('documents', 'sha256'), ('chantiers', 'plan_pdf_sha256')):
+                # Archive files written before the table or column existed
+                if column in {name for name, _ in table_columns(conn, 'archive', table)}:
+                    used.update(conn.exec_driver_sql(
+                        f"SELECT {column} FROM archive.{table} WHERE {column} IS NOT NULL").scalars())
+    return used
+
+def collect_blobs(grace_seconds=BLOB_GC_GRACE):
+    """Delete unreferenced blobs older than `grace_seconds`. Returns (files removed, bytes freed)."""
+    blob_root = os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs')
+    cutoff = time.time() - grace_seconds
+    # Files are listed before references are read: a blob stored in between is too young to go
+    candidates = [os.path.join(folder, name)
+                  for folder, _, names in os.walk(blob_root) for name in names
+                  if not name.endswith('.part') and os.path.getmtime(os.path.join(folder, name)) < cutoff]
+    used = referenced_blobs()
+    removed = freed = 0
+    for path in candidates:
+        if os.path.basename(path) in used:
+            continue
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime >= cutoff:
+                continue # Uploaded again since it was listed
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
+
+@click.command('gc-blobs')
+@with_appcontext
+@click.option('--grace', default=BLOB_GC_GRACE, show_default=True, help='Keep blobs modified less than N seconds ago.')
+def gc_blobs_command(grace):
+    """Delete uploaded files no document or chantier plan refers to, archives included."""
+    removed, freed = collect_blobs(grace)
+    click.echo(f"{removed} unreferenced blob(s) removed, {freed / 1e6:.1f} MB freed.")
+
+@click.command('archive-chantiers')
+@with_appcontext
+@click.option('--months', default=12, show_default=True, help='Archive DONE chantiers that ended more than N months ago.')
+@click.option('--vacuum', is_flag=True, help='VACUUM chantier.db afterwards to give the space back.')
+def archive_chantiers_command(months, vacuum):
+    """Move finished chantiers into data/archive/archive_<year>.db."""
+    moved = archive_done_chantiers(months)
+    if not moved:
+        click.echo("Nothing to archive.")
+    for year, count in moved.items():
+        click.echo(f"{year}: {count} chantier(s) archived")
+    if vacuum and moved:
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+        click.echo("chantier.db vacuumed.")
+
+# --- App Factory ---
+
+def configure_sqlite_connection(dbapi_connection, busy_timeout_ms):
+    # WAL mode for SQLite (Better concurrency), set on each new pooled connection
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Threaded workers: wait for the write lock instead of failing with "database is locked"
+    cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    # Safe with WAL (no corruption on power loss, at worst the last commits are lost), far fewer fsyncs
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def prewarm(app):
+    """Create data folders, open the first pooled connection, check the schema version and load the entry analytics."""
+    for key in ('DATA_FOLDER', 'UPLOAD_FOLDER'):
+        try:
+            os.makedirs(app.config[key], exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not create folder {app.config[key]}: {e}")
+    with app.app_context():
+        version = check_schema_version()
+        if HAS_NUMPY and version >= SCHEMA_VERSION:
+            # Dashboard aggregates are served from memory from the first request on
+            get_entry_columns().load()
+
+def create_app(config=None):
+    """Build the Flask app. Cheap: no disk or database access unless PREWARM is set.
+
+    Tests can get an isolated in-memory instance with
+    create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'}) followed by upgrade_db().
+    """
+    app = Flask(__name__, static_folder='../dist', static_url_path='/')
+    app.config.from_mapping(default_config())
+    if config:
+        app.config.from_mapping(config)
+    # Database and folders derived from DATA_FOLDER, unless set explicitly
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///' + os.path.join(app.config['DATA_FOLDER'], 'chantier.db'))
+    app.config.setdefault('UPLOAD_FOLDER', os.path.join(app.config['DATA_FOLDER'], 'uploads'))
+    # Rendered PDF previews live under the uploads folder so the offload proxy can serve them too
+    app.config.setdefault('PREVIEW_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'previews'))
+    # Finished chantiers moved out of chantier.db live in one SQLite file per year
+    app.config.setdefault('ARCHIVE_FOLDER', os.path.join(app.config['DATA_FOLDER'], 'archive'))
+    app.config['USE_X_SENDFILE'] = app.config['FILE_OFFLOAD'] == 'x-sendfile'
+
+    CORS(app)  # Enable CORS for development
+    db.init_app(app)
+    busy_timeout_ms = app.config['SQLITE_BUSY_TIMEOUT_MS']
+
+    def on_connect(dbapi_connection, connection_record):
+        configure_sqlite_connection(dbapi_connection, busy_timeout_ms)
+
+    with app.app_context():
+        # Engines are created lazily by SQLAlchemy: this does not connect
+        event.listen(db.engine, 'connect', on_connect)
+
+    app.extensions['result_cache'] = ResultCache(app.config['RESULT_CACHE_SIZE'])
+    app.register_blueprint(api)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(archive_chantiers_command)
+    app.cli.add_command(gc_blobs_command)
+
+    if app.config['PREWARM']:
+        prewarm(app)
+    return app
 
 if __name__ == '__main__':
+    app = create_app()
+    # Dev server: apply pending migrations directly
+    with app.app_context():
+        upgrade_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
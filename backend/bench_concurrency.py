@@ -0,0 +1,150 @@
+"""Latency of POST /api/entries while large exports run at the same time.
+
+Start the server, then from the project root:
+
+    python backend/bench_concurrency.py --seed 200000    # once, fills data/chantier.db
+    python backend/bench_concurrency.py --url http://127.0.0.1:5000
+
+Compare e.g. `gunicorn -w 1 "backend.app:create_app()"` (sync worker) with
+`gunicorn -c backend/gunicorn.conf.py` (gthread), or GROUP_COMMIT=1 with
+--clients 8. The entries created by the benchmark are deleted at the end.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+
+BENCH_DATE = '1900-01-01'  # Marks the rows created by the benchmark
+
+
+def call(url, method='GET', token=None, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method)
+    req.add_header('Content-Type', 'application/json')
+    if token:
+        req.add_header('Authorization', f'Bearer {token}')
+    with urllib.request.urlopen(req, timeout=300) as res:
+        return res.status, res.read()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def report(label, latencies):
+    ms = [v * 1000 for v in latencies]
+    print(f"{label:<28} n={len(ms):<5} p50={percentile(ms, 50):7.1f} ms  p95={percentile(ms, 95):7.1f} ms  "
+          f"p99={percentile(ms, 99):7.1f} ms  max={max(ms):7.1f} ms")
+
+
+def seed(count):
+    """Insert `count` entries straight into the local database (data/ under the current folder)."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import create_app, db, upgrade_db, User, Chantier, Entry
+
+    app = create_app()
+    with app.app_context():
+        upgrade_db()
+        user = User.query.filter_by(username='Admin').first()
+        chantiers = Chantier.query.all()
+        if not chantiers:
+            chantiers = [Chantier(nom=f'Bench {i}', annee=2024, status='ACTIVE') for i in range(20)]
+            db.session.add_all(chantiers)
+            db.session.commit()
+        rows = [{
+            'user_id': user.id,
+            'chantier_id': random.choice(chantiers).id,
+            'date': f'2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}',
+            'heures': 8.0,
+            'materiel': 0.0,
+            'status': 'VALIDATED',
+            'created_by_id': user.id
+        } for _ in range(count)]
+        first_id = (db.session.query(db.func.max(Entry.id)).scalar() or 0) + 1
+        db.session.execute(Entry.__table__.insert(), rows)
+        # Core insert: log the rows like the mapper events would, for /api/sync and the stats
+        db.session.execute(db.text("INSERT INTO changes (table_name, row_id, op) "
+                                   "SELECT 'entries', id, 'INSERT' FROM entries WHERE id >= :first ORDER BY id"),
+                           {'first': first_id})
+        db.session.commit()
+    print(f"Inserted {count} entries.")
+
+
+def run(url, pin, posts, exporters, clients):
+    user = json.loads(call(f'{url}/api/login', 'POST', body={'pin': pin})[1])
+    token, admin_id = user['token'], user['id']
+    chantiers = json.loads(call(f'{url}/api/chantiers?status=ALL', token=token)[1])
+    if not chantiers:
+        sys.exit("No chantier: run with --seed first.")
+    chantier_id = chantiers[0]['id']
+    created = []
+
+    def post_entries(n):
+        latencies = []
+
+        def client():
+            for _ in range(n // clients):
+                start = time.perf_counter()
+                _, body = call(f'{url}/api/entries', 'POST', token, {
+                    'user_id': admin_id, 'chantier_id': chantier_id, 'date': BENCH_DATE, 'heures': 1})
+                latencies.append(time.perf_counter() - start)
+                created.append(json.loads(body)['id'])
+
+        posters = [threading.Thread(target=client) for _ in range(clients)]
+        for t in posters:
+            t.start()
+        for t in posters:
+            t.join()
+        return latencies
+
+    start = time.perf_counter()
+    idle = post_entries(posts)
+    report('POST /api/entries (idle)', idle)
+    print(f"{'':<28} {len(idle) / (time.perf_counter() - start):.0f} entries/s with {clients} client(s)")
+
+    stop = threading.Event()
+    export_times = []
+
+    def export_loop():
+        while not stop.is_set():
+            start = time.perf_counter()
+            call(f'{url}/api/export', token=token)
+            export_times.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=export_loop, daemon=True) for _ in range(exporters)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)  # Let the exports start
+    report(f'POST /api/entries (+{exporters} export)', post_entries(posts))
+    stop.set()
+    for t in threads:
+        t.join()
+    report('GET /api/export', export_times)
+
+    for entry_id in created:
+        call(f'{url}/api/entries/{entry_id}', 'DELETE', token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--pin', default='000000', help='PIN of an admin user')
+    parser.add_argument('--posts', type=int, default=200, help='Entries posted per phase')
+    parser.add_argument('--exporters', type=int, default=1, help='Concurrent export loops')
+    parser.add_argument('--clients', type=int, default=1, help='Concurrent clients posting entries')
+    parser.add_argument('--seed', type=int, help='Insert N entries into the local database and exit')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+    else:
+        run(args.url.rstrip('/'), args.pin, args.posts, args.exporters, args.clients)
+
+
+if __name__ == '__main__':
+    main()
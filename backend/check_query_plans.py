@@ -0,0 +1,151 @@
+"""Run EXPLAIN QUERY PLAN on every query the API routes issue.
+
+Usage (from backend/):  python check_query_plans.py
+
+Works on a throwaway database in a temp folder. Exits with status 1 if a
+query that filters one of the WATCHED_TABLES falls back to a full table
+scan. Unfiltered queries (list everything / global totals) are
+full reads by design and are reported but allowed. Aliased tables
+(`entries e`) count as the table they alias; a built-in self-test makes
+sure an aliased scan is caught.
+"""
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+from app import create_app, db, upgrade_db
+
+WATCHED_TABLES = {'entries', 'chantiers', 'leaves', 'alerts', 'idempotency_keys', 'changes'}
+# SQLite >= 3.36 names an aliased table by its alias only ("SCAN e"), older ones "SCAN entries AS e"
+SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+(?:"?\w+"?\.)?"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE)
+NOT_ALIASES = {'where', 'join', 'left', 'right', 'inner', 'outer', 'cross', 'natural', 'on', 'using', 'group',
+               'order', 'limit', 'union', 'except', 'intersect', 'window', 'having', 'set', 'values', 'returning'}
+# Aliased full scan of an unindexed filter column: must be reported, or the check itself is broken
+SELF_TEST = "SELECT e.id FROM entries e JOIN chantiers c ON c.id = e.chantier_id WHERE e.heures > ?"
+
+
+def scanned_tables(statement, plan):
+    """Watched tables the plan reads in full, aliases mapped back to table names."""
+    names = {}
+    for table, alias in TABLE_RE.findall(statement):
+        names[table] = table
+        if alias and alias.lower() not in NOT_ALIASES:
+            names[alias] = table
+    scanned = {names.get(m.group(1), m.group(1)) for m in map(SCAN_RE.match, plan) if m}
+    return scanned & WATCHED_TABLES
+
+
+def seed(client, headers):
+    client.post('/api/users', json={'username': 'Ouvrier', 'pin': '123456', 'role': 'user'}, headers=headers)
+    for i, status in enumerate(['ACTIVE', 'FUTURE', 'DONE']):
+        client.post('/api/chantiers', json={'nom': f'Chantier {i}', 'annee': 2024 + i % 2, 'status': status,
+                                            'address_work': 'Geneve'}, headers=headers)
+    client.put('/api/chantiers/1/members', json={'user_ids': [1, 2]}, headers=headers)
+    for day in range(1, 6):
+        client.post('/api/entries', json={'user_id': 2, 'chantier_id': 1, 'date': f'2024-03-0{day}',
+                                          'heures': 8, 'materiel': 10}, headers=headers)
+    for _ in range(2):  # Retried with the same key: the second one is replayed
+        client.post('/api/leaves', json={'user_id': 2, 'type': 'VACATION', 'date_start': '2024-07-01',
+                                         'date_end': '2024-07-05', 'days_count': 5},
+                    headers={**headers, 'Idempotency-Key': 'leave-1'})
+    client.post('/api/chantiers/1/alerts', json={'title': 'Controle'}, headers=headers)
+
+
+# Requests that exercise every read path (writes are exercised by seed())
+REQUESTS = [
+    ('GET', '/api/users', None),
+    ('GET', '/api/chantiers?status=ALL', None),
+    ('GET', '/api/chantiers?status=ACTIVE', None),
+    ('GET', '/api/chantiers?status=ALL&archived=1', None),
+    ('GET', '/api/chantiers?status=ACTIVE&include=totals', None),
+    ('GET', '/api/chantiers/search?q=chan&status=ACTIVE', None),
+    ('GET', '/api/chantiers/1', None),
+    ('GET', '/api/chantiers/1/full', None),
+    ('GET', '/api/chantiers/1/entries', None),
+    ('GET', '/api/chantiers/1/entries?user_id=2', None),
+    ('GET', '/api/chantiers/1/full?user_id=2&from=2024-03-02', None),
+    ('GET', '/api/entries?user_id=2&from=2024-03-01&to=2024-03-07', None),
+    ('GET', '/api/entries', None),
+    ('GET', '/api/chantiers/1/alerts', None),
+    ('GET', '/api/chantiers/1/documents', None),
+    ('GET', '/api/entries/pending', None),
+    ('PUT', '/api/entries/1/validate', None),
+    ('PUT', '/api/entries/2', {'heures': 7}),
+    ('GET', '/api/leaves', None),
+    ('GET', '/api/leaves?user_id=2', None),
+    ('PUT', '/api/leaves/1/status', {'status': 'APPROVED'}),
+    ('PUT', '/api/alerts/1', {'is_resolved': True}),
+    ('GET', '/api/export?chantier_id=1&year=2024', None),
+    ('GET', '/api/stats', None),
+    ('GET', '/api/reports/payroll?from=2024-03-01&to=2024-03-31&status=ALL', None),
+    ('GET', '/api/reports/chantiers', None),
+    ('GET', '/api/reports/chantiers?status=ACTIVE&from=2024-03-01&to=2024-03-31', None),
+    ('GET', '/api/sync?since=0', None),
+    ('GET', '/api/sync?since=5&limit=3', None),
+    ('DELETE', '/api/entries/3', None),
+]
+
+
+def main():
+    # Scratch database and upload folders
+    app = create_app({'DATA_FOLDER': tempfile.mkdtemp(prefix='ohm_qp_')})
+    with app.app_context():
+        upgrade_db()
+    client = app.test_client()
+    token = client.post('/api/login', json={'pin': '000000'}).json['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    captured = []
+    with app.app_context():
+        engine = db.engine
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+            captured.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    seed(client, headers)
+    for method, url, body in REQUESTS:
+        response = client.open(url, method=method, json=body, headers=headers)
+        if response.status_code >= 400:
+            print(f"!! {method} {url} -> {response.status_code}")
+    event.remove(engine, 'before_cursor_execute', capture)
+
+    failures = []
+    seen = set()
+    with engine.connect() as conn:
+        plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {SELF_TEST}", (1,))]
+        if 'entries' not in scanned_tables(SELF_TEST, plan):
+            sys.exit(f"Self-test failed: aliased full scan not detected in {plan}")
+        for statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            scanned = scanned_tables(statement, plan)
+            if not scanned:
+                continue
+            one_line = ' '.join(statement.split())
+            if ' WHERE ' in f" {one_line} ":
+                failures.append((one_line, plan))
+            else:
+                print(f"ok (unfiltered read): {', '.join(sorted(scanned))}: {one_line[:100]}")
+
+    print(f"\n{len(seen)} distinct queries checked.")
+    for statement, plan in failures:
+        print(f"\nFULL SCAN: {statement}")
+        for line in plan:
+            print(f"    {line}")
+    if failures:
+        print(f"\n{len(failures)} filtered queries fall back to a full table scan.")
+        sys.exit(1)
+    print("No filtered query falls back to a full table scan.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Gunicorn configuration.
+
+    gunicorn -c backend/gunicorn.conf.py
+
+One process (SQLite has a single writer) running several threads: a slow
+/api/export or PDF download keeps one thread busy while the others keep
+serving entry submissions. Every setting can be overridden from the
+environment (GUNICORN_THREADS=16, ...).
+"""
+import os
+
+wsgi_app = os.environ.get('GUNICORN_APP', "backend.app:create_app({'PREWARM': True})")
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# gthread: each request gets its own thread and its own SQLAlchemy session
+# (Flask-SQLAlchemy scopes sessions to the app context). SQLite connections come from the
+# engine pool, and busy_timeout makes concurrent writers wait for the lock instead of failing.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Exports and large uploads can take a while on slow connections
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+
+accesslog = '-'
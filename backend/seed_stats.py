@@ -1,10 +1,12 @@
 import os
-from app import app, db, User, Chantier, Entry
+from app import create_app, db, upgrade_db, User, Chantier, Entry
 from datetime import datetime, timedelta
 import random
 
 def seed_data():
+    app = create_app()
     with app.app_context():
+        upgrade_db()
         print("Seeding mock data...")
         
         # Ensure Users
@@ -1,6 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { Entry } from '../types';
 import { Check, X } from 'lucide-react';
+import { subscribeEvents } from '../events';
 
 interface Props {
     currentUser: any;
@@ -11,6 +12,8 @@ export const AdminEntries: React.FC<Props> = () => {
 
     useEffect(() => {
         fetchPendingEntries();
+        // New and changed entries are pushed by the server (after a reconnect, refetch what was missed)
+        return subscribeEvents(['entry_created', 'entry_status', 'entry_deleted'], fetchPendingEntries, fetchPendingEntries);
     }, []);
 
     const fetchPendingEntries = async () => {
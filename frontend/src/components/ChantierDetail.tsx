@@ -34,23 +34,21 @@ export const ChantierDetail: React.FC<Props> = ({ chantier: initialChantier, cur
     // PDF Modal
     const [showPdfModal, setShowPdfModal] = useState(false);
     const [isUploadingPdf, setIsUploadingPdf] = useState(false);
+    const [pdfThumbUrl, setPdfThumbUrl] = useState<string | null>(null);
 
     useEffect(() => {
         fetchDetails();
     }, [activeTab]);
 
     const fetchDetails = async () => {
-        // Always refresh chantier to get latest status/members
-        const resChantier = await fetch(`/api/chantiers/${chantier.id}`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` } });
-        if (resChantier.ok) setChantier(await resChantier.json());
-
-        if (activeTab === 'SUIVI') {
-            const res = await fetch(`/api/chantiers/${chantier.id}/entries?role=${currentUser.role}&user_id=${currentUser.id}`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` } });
-            if (res.ok) setEntries(await res.json());
-        }
-        if (activeTab === 'ALERTES') {
-            const res = await fetch(`/api/chantiers/${chantier.id}/alerts`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` } });
-            if (res.ok) setAlerts(await res.json());
+        // Chantier, entries and alerts in a single round-trip (workers only get their own entries)
+        const mine = currentUser.role === 'admin' ? '' : `&user_id=${currentUser.id}`;
+        const res = await fetch(`/api/chantiers/${chantier.id}/full?alerts=all${mine}`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` } });
+        if (res.ok) {
+            const data = await res.json();
+            setChantier(data.chantier);
+            setEntries(data.entries);
+            setAlerts(data.alerts);
         }
     };
 
@@ -196,6 +194,24 @@ export const ChantierDetail: React.FC<Props> = ({ chantier: initialChantier, cur
         }
     };
 
+    // Lightweight first-page thumbnail (rendered server-side) instead of downloading the whole plan
+    useEffect(() => {
+        if (!showPdfModal || !chantier.plan_pdf_path) return;
+        let objectUrl: string | null = null;
+        fetch(`/api/chantiers/${chantier.id}/pdf/preview`, {
+            headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` }
+        }).then(async res => {
+            // 202 = preview still rendering, keep the placeholder
+            if (res.status !== 200) return;
+            objectUrl = window.URL.createObjectURL(await res.blob());
+            setPdfThumbUrl(objectUrl);
+        }).catch(err => console.error(err));
+        return () => {
+            if (objectUrl) window.URL.revokeObjectURL(objectUrl);
+            setPdfThumbUrl(null);
+        };
+    }, [showPdfModal, chantier.plan_pdf_path]);
+
     const handlePdfView = async () => {
         try {
             const res = await fetch(`/api/chantiers/${chantier.id}/pdf`, {
@@ -639,7 +655,6 @@ export const ChantierDetail: React.FC<Props> = ({ chantier: initialChantier, cur
                                     <Check className="text-green-500" />
                                     <div>
                                         <div className="text-green-400 font-bold text-sm">Plan disponible</div>
-                                        <div className="text-xs text-gray-400 break-all">{chantier.plan_pdf_path}</div>
                                     </div>
                                 </div>
                             ) : (
@@ -648,6 +663,12 @@ export const ChantierDetail: React.FC<Props> = ({ chantier: initialChantier, cur
                                 </div>
                             )}
 
+                            {chantier.plan_pdf_path && pdfThumbUrl && (
+                                <button onClick={handlePdfView} className="block w-full rounded-xl overflow-hidden border border-slate-700 hover:border-ohm-primary transition-all">
+                                    <img src={pdfThumbUrl} alt="Aperçu du plan" className="w-full object-contain bg-white" />
+                                </button>
+                            )}
+
                             <div className="grid grid-cols-1 gap-3">
                                 {chantier.plan_pdf_path && (
                                     <button
@@ -37,13 +37,20 @@ export const Dashboard: React.FC<Props> = ({ currentUser, onSelectChantier }) =>
     }, []);
 
     useEffect(() => {
-        const statusFiltered = filterStatus === 'ALL'
-            ? chantiers
-            : chantiers.filter(c => c.status === filterStatus);
-        const q = searchQuery.trim().toLowerCase();
-        setFilteredChantiers(
-            q ? statusFiltered.filter(c => c.nom.toLowerCase().includes(q)) : statusFiltered
-        );
+        const q = searchQuery.trim();
+        if (!q) {
+            setFilteredChantiers(filterStatus === 'ALL'
+                ? chantiers
+                : chantiers.filter(c => c.status === filterStatus));
+            return;
+        }
+        // Server-side full-text search (name, addresses, remarks), debounced while typing
+        const timer = setTimeout(async () => {
+            const params = new URLSearchParams({ q, status: filterStatus });
+            const res = await fetch(`/api/chantiers/search?${params.toString()}`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` } });
+            if (res.ok) setFilteredChantiers(await res.json());
+        }, 250);
+        return () => clearTimeout(timer);
     }, [filterStatus, chantiers, searchQuery]);
 
     const fetchChantiers = async () => {
@@ -52,13 +59,24 @@ export const Dashboard: React.FC<Props> = ({ currentUser, onSelectChantier }) =>
     };
 
     const handleExport = async () => {
-        const params = new URLSearchParams();
-        if (exportYear) params.set('year', exportYear.toString());
-        if (exportSemester !== 'ALL') params.set('semester', exportSemester);
+        const headers = { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` };
         try {
-            const res = await fetch(`/api/export?${params.toString()}`, {
-                headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` }
+            // Built in the background: poll until the file is ready (202 = still running)
+            const job = await fetch('/api/exports', {
+                method: 'POST',
+                headers: { ...headers, 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    year: exportYear || null,
+                    semester: exportSemester !== 'ALL' ? exportSemester : null
+                })
             });
+            if (!job.ok) { alert('Erreur lors de l\'export'); return; }
+            const { id } = await job.json();
+            let res = await fetch(`/api/exports/${id}`, { headers });
+            while (res.status === 202) {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                res = await fetch(`/api/exports/${id}`, { headers });
+            }
             if (!res.ok) { alert('Erreur lors de l\'export'); return; }
             const blob = await res.blob();
             const url = window.URL.createObjectURL(blob);
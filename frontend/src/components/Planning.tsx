@@ -2,6 +2,7 @@ import React, { useEffect, useState } from 'react';
 import { User, Leave } from '../types';
 import { Calendar, Plus, Clock, ChevronLeft, ChevronRight } from 'lucide-react';
 import { StatusBadge } from './StatusBadge';
+import { subscribeEvents } from '../events';
 
 // Helper to get days in month
 const getDaysInMonth = (year: number, month: number) => new Date(year, month + 1, 0).getDate();
@@ -150,6 +151,9 @@ export const Planning: React.FC<Props> = ({ currentUser }) => {
 
     useEffect(() => {
         fetchLeaves();
+        if (currentUser.role !== 'admin') return;
+        // Leave requests and decisions are pushed by the server
+        return subscribeEvents(['leave_created', 'leave_status', 'leave_deleted'], fetchLeaves);
     }, [activeTab]);
 
     const fetchLeaves = async () => {
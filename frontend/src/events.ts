@@ -0,0 +1,43 @@
+// Server-Sent Events from /api/events. EventSource cannot send the Authorization header:
+// every connection first gets a single-use ticket, so the session token never appears in a URL.
+// EventSource would reconnect with the spent ticket, so reconnects are done here with a new one.
+export function subscribeEvents(names: string[], onEvent: () => void, onReconnect?: () => void): () => void {
+    let source: EventSource | null = null;
+    let retry: number | undefined;
+    let closed = false;
+    let connected = false;
+
+    const connect = async () => {
+        const res = await fetch('/api/events/ticket', {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${localStorage.getItem('ohm_token')}` }
+        }).catch(() => null);
+        if (closed) return;
+        if (!res || !res.ok) {
+            // Not an admin or logged out: no point in retrying
+            if (res && (res.status === 401 || res.status === 403)) return;
+            retry = window.setTimeout(connect, 3000);
+            return;
+        }
+        const { ticket } = await res.json();
+        if (closed) return;
+        source = new EventSource(`/api/events?ticket=${encodeURIComponent(ticket)}`);
+        names.forEach(name => source!.addEventListener(name, onEvent));
+        source.onopen = () => {
+            if (connected) onReconnect?.();
+            connected = true;
+        };
+        source.onerror = () => {
+            source?.close();
+            source = null;
+            retry = window.setTimeout(connect, 3000);
+        };
+    };
+
+    connect();
+    return () => {
+        closed = true;
+        window.clearTimeout(retry);
+        source?.close();
+    };
+}
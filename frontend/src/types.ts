@@ -20,7 +20,16 @@ export interface Chantier {
     date_end?: string;
     remarque?: string;
     status: ChantierStatus;
+    budget?: number | null; // Compared to costs in /api/reports/chantiers
     members: number[]; // Array of User IDs
+    totals?: ChantierTotals; // Only with ?include=totals
+}
+
+export interface ChantierTotals {
+    entries: number;
+    hours: number;
+    material: number;
+    pending: number;
 }
 
 export interface Entry {
@@ -47,6 +56,17 @@ export interface Leave {
     days_count: number;
 }
 
+export interface Document {
+    id: number;
+    chantier_id: number;
+    kind: 'PLAN' | 'DEVIS' | 'PHOTO' | 'OTHER';
+    filename: string;
+    size: number;
+    sha256: string;
+    mime: string;
+    created_at: string;
+}
+
 export interface Alert {
     id: number;
     chantier_id: number;